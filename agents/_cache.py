@@ -0,0 +1,51 @@
+"""
+Prompt Response Cache
+מטמון LRU קטן לתשובות המודל, לפי hash של הפרומפט
+"""
+import hashlib
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    נרמול לזיהוי כמעט-כפילויות: רווחים, שורות ריקות ואותיות גדולות/קטנות
+    לא משנים את משמעות הפרומפט, אז הם לא צריכים לשבור את המטמון.
+    """
+    return " ".join(prompt.split()).casefold()
+
+
+def prompt_key(*parts: str) -> bytes:
+    """מפתח קצר וקבוע (BLAKE2b, 16 בתים) מרכיבי הבקשה"""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\x00')  # מפריד - שלא יהיו התנגשויות בין חלוקות שונות
+    return digest.digest()
+
+
+class PromptCache:
+    """
+    מטמון LRU בזיכרון.
+    חוסך קריאות חוזרות ל-Gemini על אותו קלט בדיוק.
+    """
+
+    def __init__(self, maxsize: int = 512):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """מחזיר ערך שמור (או None) ומסמן אותו כשימוש אחרון"""
+        try:
+            value = self._data[key]
+        except KeyError:
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        """שמירת ערך, עם פינוי הישן ביותר כשהמטמון מלא"""
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
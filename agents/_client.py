@@ -0,0 +1,123 @@
+"""
+Shared Gemini client
+מודל Gemini משותף לכל הסוכנים - הגדרה אחת ומופע אחד לכל שם מודל
+"""
+import json
+import logging
+import time
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import orjson
+
+from config import config
+
+if TYPE_CHECKING:
+    import google.generativeai as genai
+
+logger = logging.getLogger(__name__)
+
+# שרשרת מודלים: ראשי ואחריו גיבוי זול יותר (GEMINI_MODELS בסביבה)
+MODEL_CHAIN = config.GEMINI_MODELS
+
+# כמה זמן לדלג על מודל שנכשל (שניות)
+UNHEALTHY_COOLDOWN = 60
+
+_configured = False
+_unhealthy_until: Dict[str, float] = {}
+
+
+class ModelRef(NamedTuple):
+    """הפניה למודל - המופע עצמו (וה-SDK) נטענים רק בקריאה הראשונה"""
+    name: str
+    system_instruction: Optional[str] = None
+
+
+@lru_cache(maxsize=None)
+def get_model(name: str, system_instruction: Optional[str] = None) -> "genai.GenerativeModel":
+    """מחזיר מופע GenerativeModel משותף לפי שם המודל (והוראת המערכת, אם יש)"""
+    # ייבוא עצל - ה-SDK גורר grpc/protobuf ומאט את עליית השרת
+    import google.generativeai as genai
+
+    global _configured
+    if not _configured:
+        genai.configure(api_key=config.GEMINI_API_KEY)
+        _configured = True
+    return genai.GenerativeModel(name, system_instruction=system_instruction)
+
+
+def get_models(system_instruction: Optional[str] = None) -> List[ModelRef]:
+    """מחזיר את שרשרת המודלים (ראשי + גיבוי)"""
+    return [ModelRef(name, system_instruction) for name in MODEL_CHAIN]
+
+
+@lru_cache(maxsize=None)
+def _retryable_errors() -> Tuple[type, ...]:
+    """שגיאות זמניות (עומס / 5xx / timeout) שמצדיקות מעבר למודל הבא"""
+    from google.api_core import exceptions as google_exceptions
+
+    return (
+        google_exceptions.ResourceExhausted,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.DeadlineExceeded,
+        google_exceptions.InternalServerError,
+    )
+
+
+async def generate_with_fallback(
+    models: Sequence[ModelRef],
+    contents: Any,
+    **kwargs
+):
+    """
+    קורא ל-generate_content_async על המודל הבריא הראשון בשרשרת.
+
+    בשגיאה זמנית המודל מסומן כלא-בריא ל-UNHEALTHY_COOLDOWN שניות
+    וממשיכים לבא בתור. שגיאות אחרות נזרקות כרגיל - אבל אם כבר עברנו לגיבוי,
+    נזרקת השגיאה המקורית של המודל הראשון (ולא, למשל, NotFound של הגיבוי).
+    """
+    now = time.monotonic()
+    healthy = [m for m in models if _unhealthy_until.get(m.name, 0) <= now]
+    # אם כולם מסומנים כלא-בריאים - ננסה בכל זאת את כולם
+    candidates = healthy or list(models)
+
+    primary_error = None
+    for ref in candidates:
+        try:
+            model = get_model(*ref)
+            return await model.generate_content_async(contents, **kwargs)
+        except _retryable_errors() as e:
+            _unhealthy_until[ref.name] = time.monotonic() + UNHEALTHY_COOLDOWN
+            logger.warning(f"Model {ref.name} unavailable, falling back: {e}")
+            primary_error = primary_error or e
+        except Exception as e:
+            if primary_error is None:
+                raise
+            logger.error(f"Fallback model {ref.name} failed: {e}")
+            raise primary_error from e
+
+    raise primary_error
+
+
+async def generate_json(
+    models: Sequence[ModelRef],
+    contents: Any,
+    generation_config: Dict[str, Any]
+) -> Any:
+    """
+    קריאה ב-streaming: החלקים נאספים לרשימה ומפוענחים פעם אחת בסוף.
+    תשובה שלא נגמרת ב-"}" נקטעה - לא מנסים לפענח אותה.
+    """
+    response = await generate_with_fallback(
+        models,
+        contents,
+        generation_config=generation_config,
+        stream=True
+    )
+    chunks = []
+    async for chunk in response:
+        chunks.append(chunk.text)
+    text = "".join(chunks)
+    if not text.rstrip().endswith("}"):
+        raise json.JSONDecodeError("truncated JSON response", text, len(text))
+    return orjson.loads(text)
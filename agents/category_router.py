@@ -2,16 +2,76 @@
 Category Router Agent
 זיהוי אוטומטי של קטגוריית הפרומפט
 """
-import json
+import itertools
 import logging
+import re
+import sys
 from typing import Tuple
-import google.generativeai as genai
+import orjson
 
-from config import config
 from core.models import PromptCategory
+from agents._client import get_models, generate_with_fallback
+from agents._cache import PromptCache, prompt_key
 
 logger = logging.getLogger(__name__)
 
+# מיפוי ישיר מערך לקטגוריה - בלי לעבור דרך Enum.__call__
+_CATEGORY_MAP = {c.value: c for c in PromptCategory}
+
+# תיאורי הקטגוריות בעברית
+_CATEGORY_DESCRIPTIONS = {
+    PromptCategory.CODE: "💻 קוד ותכנות",
+    PromptCategory.IMAGE_GENERATION: "🎨 יצירת תמונות",
+    PromptCategory.CREATIVE: "✍️ כתיבה יצירתית",
+    PromptCategory.ANALYSIS: "📊 ניתוח ומחקר",
+    PromptCategory.BUSINESS: "💼 עסקים ואסטרטגיה",
+    PromptCategory.EDUCATION: "📚 חינוך ולימוד",
+    PromptCategory.GENERAL: "🌐 כללי"
+}
+
+# ביטחון לפי מספר מילות המפתח שנמצאו, עד תקרה
+_KEYWORD_MAX_CONFIDENCE = 0.9
+
+
+def _keyword_confidence(score: int) -> float:
+    return min(_KEYWORD_MAX_CONFIDENCE, 0.3 + score * 0.15)
+
+
+# הניקוד הקטן ביותר שבו הביטחון כבר בתקרה - ניקוד נוסף לא משנה אותו
+_KEYWORD_CAP_SCORE = next(
+    s for s in itertools.count(1) if _keyword_confidence(s) == _KEYWORD_MAX_CONFIDENCE
+)
+
+_DETECT_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "temperature": 0.1
+}
+
+# תבנית זיהוי הקטגוריה - החלק הקבוע מחושב פעם אחת, רק הפרומפט משתנה
+_DETECT_PROMPT_PREFIX = """[זיהוי קטגוריה - עברית]
+
+פרומפט: \""""
+
+_DETECT_PROMPT_SUFFIX = """\"
+
+בחר את הקטגוריה המתאימה ביותר:
+- code: כתיבת קוד, סקריפטים, תכנות, debugging
+- image_generation: פרומפטים ליצירת תמונות (Midjourney, DALL-E, Stable Diffusion וכו')
+- creative: כתיבה יצירתית טקסטואלית, שיווק, תוכן, סיפורים (לא תמונות!)
+- analysis: ניתוח נתונים, מחקר, השוואות, דוחות
+- business: החלטות עסקיות, אסטרטגיה, מכירות
+- education: הסברים, לימוד, הדרכות, תרגילים
+- general: כל השאר
+
+שים לב: אם הפרומפט מיועד ליצירת תמונה (מזכיר Midjourney, DALL-E, תמונה, אילוסטרציה, ציור וכו') - זה image_generation!
+
+החזר JSON:
+{
+    "category": "code|image_generation|creative|analysis|business|education|general",
+    "confidence": 0.0-1.0,
+    "reasoning": "הסבר קצר"
+}"""
+
 
 class CategoryRouter:
     """
@@ -20,8 +80,8 @@ class CategoryRouter:
     """
     
     def __init__(self):
-        genai.configure(api_key=config.GEMINI_API_KEY)
-        self.model = genai.GenerativeModel('gemini-2.0-flash')
+        self.models = get_models()
+        self._ai_cache = PromptCache(maxsize=512)
         
         # מילות מפתח לזיהוי מהיר (fallback)
         self.keyword_hints = {
@@ -53,6 +113,33 @@ class CategoryRouter:
                 "תלמיד", "חינוך", "tutorial", "guide"
             ]
         }
+        
+        # נרמול חד-פעמי: אותיות קטנות + interning, כדי לא לחזור על זה בכל קריאה
+        self.keyword_hints = {
+            category: tuple(sys.intern(kw.lower()) for kw in keywords)
+            for category, keywords in self.keyword_hints.items()
+        }
+        # מספר מילות המפתח של כל קטגוריה - התקרה לניקוד שעוד אפשר לצבור בסריקה
+        self._keyword_counts = {
+            category: len(set(keywords))
+            for category, keywords in self.keyword_hints.items()
+        }
+        
+        # regex אחד לכל מילות המפתח - סריקה אחת של הפרומפט ב-C
+        # מילה יכולה להופיע בכמה קטגוריות (למשל "שיווק"), לכן הערך הוא tuple
+        keyword_categories = {}
+        for category, keywords in self.keyword_hints.items():
+            for kw in keywords:
+                keyword_categories.setdefault(kw, []).append(category)
+        self._keyword_categories = {
+            kw: tuple(categories) for kw, categories in keyword_categories.items()
+        }
+        # הארוך קודם (regex בוחר את החלופה הראשונה, לא הארוכה),
+        # ו-lookahead כדי לתפוס גם מילים חופפות ("hyper realistic" + "realistic")
+        alternatives = sorted(self._keyword_categories, key=len, reverse=True)
+        self._keyword_re = re.compile(
+            "(?=(" + "|".join(re.escape(kw) for kw in alternatives) + "))"
+        )
     
     async def detect_category(self, prompt: str) -> Tuple[PromptCategory, float]:
         """
@@ -64,52 +151,43 @@ class CategoryRouter:
         Returns:
             tuple של (קטגוריה, רמת ביטחון 0-1)
         """
-        # ניסיון ראשון: זיהוי עם AI
+        # ניסיון ראשון: זיהוי מהיר לפי מילות מפתח - בלי קריאת רשת
+        keyword_result = self._detect_with_keywords(prompt)
+        if keyword_result[1] >= 0.75:
+            return keyword_result
+
+        # זיהוי עם AI רק כשמילות המפתח לא חד-משמעיות
         try:
-            category, confidence = await self._detect_with_ai(prompt)
+            key = prompt_key(prompt)
+            cached = self._ai_cache.get(key)
+            if cached is None:
+                cached = await self._detect_with_ai(prompt)
+                self._ai_cache.set(key, cached)
+            category, confidence = cached
             if confidence >= 0.7:
                 return category, confidence
         except Exception as e:
             logger.warning(f"AI detection failed, using fallback: {e}")
-        
-        # fallback: זיהוי לפי מילות מפתח
-        return self._detect_with_keywords(prompt)
+
+        # fallback: תוצאת מילות המפתח
+        return keyword_result
     
     async def _detect_with_ai(self, prompt: str) -> Tuple[PromptCategory, float]:
         """זיהוי עם AI"""
-        detection_prompt = f"""[זיהוי קטגוריה - עברית]
+        detection_prompt = _DETECT_PROMPT_PREFIX + prompt + _DETECT_PROMPT_SUFFIX
 
-פרומפט: "{prompt}"
-
-בחר את הקטגוריה המתאימה ביותר:
-- code: כתיבת קוד, סקריפטים, תכנות, debugging
-- image_generation: פרומפטים ליצירת תמונות (Midjourney, DALL-E, Stable Diffusion וכו')
-- creative: כתיבה יצירתית טקסטואלית, שיווק, תוכן, סיפורים (לא תמונות!)
-- analysis: ניתוח נתונים, מחקר, השוואות, דוחות
-- business: החלטות עסקיות, אסטרטגיה, מכירות
-- education: הסברים, לימוד, הדרכות, תרגילים
-- general: כל השאר
-
-שים לב: אם הפרומפט מיועד ליצירת תמונה (מזכיר Midjourney, DALL-E, תמונה, אילוסטרציה, ציור וכו') - זה image_generation!
-
-החזר JSON:
-{{
-    "category": "code|image_generation|creative|analysis|business|education|general",
-    "confidence": 0.0-1.0,
-    "reasoning": "הסבר קצר"
-}}"""
-
-        response = await self.model.generate_content_async(
+        response = await generate_with_fallback(
+            self.models,
             detection_prompt,
-            generation_config={
-                "response_mime_type": "application/json",
-                "temperature": 0.1
-            }
+            generation_config=_DETECT_GENERATION_CONFIG
         )
         
-        result = json.loads(response.text)
-        category = PromptCategory(result["category"])
+        result = orjson.loads(response.text)
+        category = _CATEGORY_MAP.get(result["category"])
         confidence = float(result["confidence"])
+        if category is None:
+            # קטגוריה לא מוכרת מהמודל - כללי, בביטחון אפס (ייפול למילות מפתח)
+            category, confidence = PromptCategory.GENERAL, 0.0
         
         logger.debug(f"AI detected: {category} ({confidence:.2f}) - {result.get('reasoning', '')}")
         
@@ -118,31 +196,41 @@ class CategoryRouter:
     def _detect_with_keywords(self, prompt: str) -> Tuple[PromptCategory, float]:
         """זיהוי לפי מילות מפתח (fallback)"""
         prompt_lower = prompt.lower()
-        scores = {}
+        # מאותחל בסדר keyword_hints - בתיקו max בוחר את הקטגוריה הראשונה בסדר הזה,
+        # לא את זו שמילת המפתח שלה הופיעה ראשונה בטקסט
+        scores = dict.fromkeys(self.keyword_hints, 0)
         
-        for category, keywords in self.keyword_hints.items():
-            score = sum(1 for kw in keywords if kw in prompt_lower)
-            if score > 0:
-                scores[category] = score
+        # כל מילת מפתח נספרת פעם אחת, גם אם הופיעה כמה פעמים
+        seen = set()
+        remaining = dict(self._keyword_counts)
+        for match in self._keyword_re.finditer(prompt_lower):
+            kw = match.group(1)
+            if kw in seen:
+                continue
+            seen.add(kw)
+            at_cap = False
+            for category in self._keyword_categories[kw]:
+                scores[category] += 1
+                remaining[category] -= 1
+                at_cap |= scores[category] >= _KEYWORD_CAP_SCORE
+            
+            # יציאה מוקדמת רק כשהתוצאה כבר סופית: הביטחון של המוביל בתקרה,
+            # ואף קטגוריה אחרת לא יכולה להשוות לו גם עם כל המילים שנותרו לה
+            if at_cap:
+                leader = max(scores, key=scores.get)
+                lead = scores[leader]
+                if lead >= _KEYWORD_CAP_SCORE and all(
+                    scores[c] + left < lead
+                    for c, left in remaining.items() if c is not leader
+                ):
+                    break
         
-        if not scores:
+        if not seen:
             return PromptCategory.GENERAL, 0.3
         
         best_category = max(scores, key=scores.get)
-        max_score = scores[best_category]
-        confidence = min(0.9, 0.3 + (max_score * 0.15))
-        
-        return best_category, confidence
+        return best_category, _keyword_confidence(scores[best_category])
     
     def get_category_description(self, category: PromptCategory) -> str:
         """מחזיר תיאור הקטגוריה בעברית"""
-        descriptions = {
-            PromptCategory.CODE: "💻 קוד ותכנות",
-            PromptCategory.IMAGE_GENERATION: "🎨 יצירת תמונות",
-            PromptCategory.CREATIVE: "✍️ כתיבה יצירתית",
-            PromptCategory.ANALYSIS: "📊 ניתוח ומחקר",
-            PromptCategory.BUSINESS: "💼 עסקים ואסטרטגיה",
-            PromptCategory.EDUCATION: "📚 חינוך ולימוד",
-            PromptCategory.GENERAL: "🌐 כללי"
-        }
-        return descriptions.get(category, "🌐 כללי")
+        return _CATEGORY_DESCRIPTIONS.get(category, "🌐 כללי")
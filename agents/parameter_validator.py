@@ -4,14 +4,21 @@ Parameter Validator Agent
 """
 import json
 import logging
+import string
 from typing import List, Dict, Any
-import google.generativeai as genai
+import orjson
 
-from config import config
 from core.models import PromptCategory, MissingParameter
+from agents._client import get_models, generate_with_fallback
+from agents._cache import PromptCache, prompt_key
 
 logger = logging.getLogger(__name__)
 
+_VALIDATION_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "temperature": 0.2
+}
+
 
 # פרמטרים נדרשים/מומלצים לכל קטגוריה
 CATEGORY_PARAMETERS: Dict[PromptCategory, List[Dict[str, Any]]] = {
@@ -187,6 +194,53 @@ CATEGORY_PARAMETERS: Dict[PromptCategory, List[Dict[str, Any]]] = {
     ]
 }
 
+# הפרמטרים של כל קטגוריה כ-JSON מוכן - מחושב פעם אחת בטעינה
+_CATEGORY_PARAMS_JSON: Dict[PromptCategory, str] = {
+    category: json.dumps(params, ensure_ascii=False, indent=2)
+    for category, params in CATEGORY_PARAMETERS.items()
+}
+
+# תבנית הבדיקה - רק הפרומפט משתנה בין קריאות,
+# הסיומת (קטגוריה + פרמטרים צפויים) מחושבת מראש לכל קטגוריה
+_VALIDATION_PROMPT_PREFIX = """[בדיקת פרמטרים - עברית]
+
+פרומפט: \""""
+
+_VALIDATION_PROMPT_SUFFIX_TMPL = string.Template("""\"
+קטגוריה: $category
+
+הפרמטרים הצפויים לקטגוריה זו:
+$expected_params
+
+לכל פרמטר, בדוק האם הוא מוזכר בפרומפט (גם אם במילים אחרות או באופן משתמע).
+
+החזר JSON:
+{
+    "found": [
+        {"name": "...", "value_in_prompt": "מה שנמצא בפרומפט"}
+    ],
+    "missing": [
+        {"name": "...", "question": "שאלה בעברית", "importance": "required|recommended"}
+    ]
+}
+
+הערות:
+- אם פרמטר משתמע מההקשר, הוא "found"
+- אם פרמטר לא רלוונטי לפרומפט הספציפי, אל תכלול אותו ב-missing
+- התמקד רק בפרמטרים שבאמת יעזרו לשפר את הפרומפט""")
+
+# סיומת לכל ערך של PromptCategory - קטגוריה בלי פרמטרים משלה מקבלת את אלה של GENERAL
+_VALIDATION_PROMPT_SUFFIXES: Dict[PromptCategory, str] = {
+    category: _VALIDATION_PROMPT_SUFFIX_TMPL.substitute(
+        category=category.value,
+        expected_params=_CATEGORY_PARAMS_JSON.get(
+            category, _CATEGORY_PARAMS_JSON[PromptCategory.GENERAL]
+        )
+    )
+    for category in PromptCategory
+}
+assert _VALIDATION_PROMPT_SUFFIXES.keys() == set(PromptCategory), "missing validation suffix"
+
 
 class ParameterValidator:
     """
@@ -195,8 +249,8 @@ class ParameterValidator:
     """
     
     def __init__(self):
-        genai.configure(api_key=config.GEMINI_API_KEY)
-        self.model = genai.GenerativeModel('gemini-2.0-flash')
+        self.models = get_models()
+        self._cache = PromptCache(maxsize=512)
     
     async def validate(
         self, 
@@ -213,52 +267,31 @@ class ParameterValidator:
         Returns:
             רשימת פרמטרים חסרים
         """
-        expected_params = CATEGORY_PARAMETERS.get(category, CATEGORY_PARAMETERS[PromptCategory.GENERAL])
+        key = prompt_key(prompt, category.value)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return list(cached)
         
         # בדיקה עם AI
-        validation_prompt = f"""[בדיקת פרמטרים - עברית]
-
-פרומפט: "{prompt}"
-קטגוריה: {category.value}
-
-הפרמטרים הצפויים לקטגוריה זו:
-{json.dumps(expected_params, ensure_ascii=False, indent=2)}
-
-לכל פרמטר, בדוק האם הוא מוזכר בפרומפט (גם אם במילים אחרות או באופן משתמע).
-
-החזר JSON:
-{{
-    "found": [
-        {{"name": "...", "value_in_prompt": "מה שנמצא בפרומפט"}}
-    ],
-    "missing": [
-        {{"name": "...", "question": "שאלה בעברית", "importance": "required|recommended"}}
-    ]
-}}
-
-הערות:
-- אם פרמטר משתמע מההקשר, הוא "found"
-- אם פרמטר לא רלוונטי לפרומפט הספציפי, אל תכלול אותו ב-missing
-- התמקד רק בפרמטרים שבאמת יעזרו לשפר את הפרומפט"""
+        validation_prompt = _VALIDATION_PROMPT_PREFIX + prompt + _VALIDATION_PROMPT_SUFFIXES[category]
 
         try:
-            response = await self.model.generate_content_async(
+            response = await generate_with_fallback(
+                self.models,
                 validation_prompt,
-                generation_config={
-                    "response_mime_type": "application/json",
-                    "temperature": 0.2
-                }
+                generation_config=_VALIDATION_GENERATION_CONFIG
             )
             
-            result = json.loads(response.text)
+            result = orjson.loads(response.text)
             
+            mp = MissingParameter  # קישור מקומי - חוסך חיפוש גלובלי בכל איטרציה
             missing = [
-                MissingParameter(
+                mp(
                     name=p["name"],
                     question=p["question"],
                     importance=p.get("importance", "recommended")
                 )
-                for p in result.get("missing", [])
+                for p in result.get("missing", ())
             ]
             
             # לוג מה נמצא (לדיבוג)
@@ -266,6 +299,7 @@ class ParameterValidator:
             logger.debug(f"Found parameters: {[f['name'] for f in found]}")
             logger.debug(f"Missing parameters: {[m.name for m in missing]}")
             
+            self._cache.set(key, tuple(missing))
             return missing
             
         except Exception as e:
@@ -282,14 +316,16 @@ class ParameterValidator:
         מחזיר רשימת שאלות לשאול את המשתמש.
         ממיין לפי חשיבות ומגביל כמות.
         """
-        # קודם required, אחר כך recommended
-        sorted_params = sorted(
-            missing_params,
-            key=lambda p: (0 if p.importance == "required" else 1)
-        )
-        
+        # קודם required, אחר כך recommended - חלוקה במעבר אחד, בלי מיון
+        required = []
+        recommended = []
+        for param in missing_params:
+            (required if param.importance == "required" else recommended).append(param)
+        top_params = required[:max_questions]
+        top_params += recommended[:max_questions - len(top_params)]
+
         questions = []
-        for param in sorted_params[:max_questions]:
+        for param in top_params:
             importance_mark = "❗" if param.importance == "required" else "💭"
             questions.append(f"{importance_mark} {param.question}")
         
@@ -2,16 +2,104 @@
 Refiner Agent
 סוכן שמשפר פרומפטים על בסיס הביקורת
 """
+import asyncio
 import json
 import logging
-from typing import Optional, List
-import google.generativeai as genai
+import re
+import string
+from typing import AsyncIterator, Optional, List, Tuple
 
-from config import config
 from core.models import PromptCategory, CritiqueResult, Weakness, MissingParameter, ProTip
+from agents._client import get_models, generate_with_fallback
+from agents._cache import PromptCache, prompt_key
+from agents.shadow_critic import ShadowCritic
 
 logger = logging.getLogger(__name__)
 
+_REFINE_GENERATION_CONFIG = {
+    "temperature": 0.4,  # מאוזן - לא יצירתי מדי, לא נוקשה מדי
+    "max_output_tokens": 1000
+}
+
+# שמות הטכניקות בעברית
+_TECHNIQUE_NAMES = {
+    "role_playing": "הגדרת תפקיד",
+    "chain_of_thought": "חשיבה שלב-אחר-שלב",
+    "few_shot": "דוגמאות",
+    "constraints": "מגבלות",
+    "structure": "מבנה",
+    "creativity": "יצירתיות"
+}
+
+# גדר קוד שעוטפת את כל התשובה: ```text ... ```
+_FENCE_RE = re.compile(r'\A\s*```(?:text|markdown)?[ \t]*\n?|\n?[ \t]*```\s*\Z')
+
+# טמפרטורות למועמדים המקבילים בשיפור האיטרטיבי
+_CANDIDATE_TEMPERATURES = (0.3, 0.5, 0.7)
+
+_EXPLANATION_GENERATION_CONFIG = {
+    "temperature": 0.5,
+    "max_output_tokens": 300
+}
+
+
+# תבניות הפרומפטים - מקומפלות פעם אחת, רק הערכים המשתנים מוצבים בכל קריאה
+_REFINE_PROMPT_TMPL = string.Template("""[מצב שיפור פרומפט מקצועי - עברית]
+
+פרומפט מקורי:
+"$original_prompt"
+
+קטגוריה: $category
+ציון נוכחי: $score/10
+
+## נקודות חולשה לתיקון:
+$weaknesses
+
+## פרמטרים חסרים:
+$missing_params
+
+## טיפים מקצועיים ליישום (חשוב מאוד!):
+$pro_tips
+
+$user_answers
+
+## משימה: צור פרומפט משופר ומקצועי
+
+הפרומפט המשופר חייב:
+
+1. **לתקן את כל נקודות החולשה** - כל בעיה שזוהתה צריכה להיות מטופלת
+2. **ליישם את הטיפים המקצועיים** - זה החלק הכי חשוב! תשתמש בטכניקות שהומלצו
+3. **לשמור על הכוונה המקורית** - אל תשנה את המטרה של המשתמש
+4. **להיות מקצועי ואפקטיבי** - פרומפט שייתן תוצאות טובות יותר
+
+טכניקות שחובה לשקול:
+- 🎭 Role Playing: הגדר למודל תפקיד מומחה אם רלוונטי
+- 🔗 Chain of Thought: בקש שלבי חשיבה אם המשימה מורכבת
+- 📝 Few-Shot: הוסף דוגמה לפלט הרצוי אם לא ברור
+- 🎯 Constraints: הוסף מגבלות שמחדדות את המשימה
+- 📐 Structure: ארגן את הפרומפט במבנה ברור
+
+החזר רק את הפרומפט המשופר, ללא הסברים או הערות נוספות.
+הפרומפט צריך להיות מוכן לשימוש ישיר.""")
+
+_EXPLANATION_PROMPT_TMPL = string.Template("""[הסבר שיפורים - עברית]
+
+פרומפט מקורי:
+"$original_prompt"
+
+פרומפט משופר:
+"$improved_prompt"
+
+נקודות חולשה שטופלו:
+$weaknesses
+
+כתוב הסבר קצר (3-5 משפטים) בעברית שמסביר:
+1. מה היו הבעיות העיקריות
+2. איך הפרומפט המשופר מטפל בהן
+3. למה זה ישפר את התוצאות
+
+שמור על טון ידידותי ומעודד. אל תהיה ביקורתי מדי.""")
+
 
 class PromptRefiner:
     """
@@ -24,16 +112,18 @@ class PromptRefiner:
     """
     
     def __init__(self):
-        genai.configure(api_key=config.GEMINI_API_KEY)
         # מודל איכותי יותר לשיפור
-        self.model = genai.GenerativeModel('gemini-2.0-flash')
+        self.models = get_models()
+        self._cache = PromptCache(maxsize=512)
+        self._critic: Optional[ShadowCritic] = None  # נוצר בשימוש הראשון
     
     async def refine(
         self,
         original_prompt: str,
         category: PromptCategory,
         critique: CritiqueResult,
-        user_answers: Optional[dict] = None
+        user_answers: Optional[dict] = None,
+        temperature: Optional[float] = None
     ) -> str:
         """
         משפר פרומפט על בסיס הביקורת והטיפים המקצועיים.
@@ -43,106 +133,150 @@ class PromptRefiner:
             category: הקטגוריה שזוהתה
             critique: תוצאת הביקורת
             user_answers: תשובות המשתמש לשאלות (אופציונלי)
+            temperature: טמפרטורה (ברירת מחדל 0.4)
             
         Returns:
             הפרומפט המשופר
         """
-        # בניית הקשר מהביקורת
-        weaknesses_text = self._format_weaknesses(critique.weaknesses)
-        missing_params_text = self._format_missing_params(critique.missing_params)
-        pro_tips_text = self._format_pro_tips(critique.pro_tips)
-        user_answers_text = self._format_user_answers(user_answers) if user_answers else ""
+        # מטמון - רק כשאין תשובות משתמש (הן משנות את התוצאה)
+        cache_key = None
+        if not user_answers:
+            cache_key = prompt_key(
+                original_prompt, category.value, critique.model_dump_json(), str(temperature)
+            )
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                return cached
         
-        refinement_prompt = f"""[מצב שיפור פרומפט מקצועי - עברית]
-
-פרומפט מקורי:
-"{original_prompt}"
-
-קטגוריה: {category.value}
-ציון נוכחי: {critique.overall_score}/10
-
-## נקודות חולשה לתיקון:
-{weaknesses_text}
-
-## פרמטרים חסרים:
-{missing_params_text}
-
-## טיפים מקצועיים ליישום (חשוב מאוד!):
-{pro_tips_text}
-
-{user_answers_text}
-
-## משימה: צור פרומפט משופר ומקצועי
-
-הפרומפט המשופר חייב:
-
-1. **לתקן את כל נקודות החולשה** - כל בעיה שזוהתה צריכה להיות מטופלת
-2. **ליישם את הטיפים המקצועיים** - זה החלק הכי חשוב! תשתמש בטכניקות שהומלצו
-3. **לשמור על הכוונה המקורית** - אל תשנה את המטרה של המשתמש
-4. **להיות מקצועי ואפקטיבי** - פרומפט שייתן תוצאות טובות יותר
-
-טכניקות שחובה לשקול:
-- 🎭 Role Playing: הגדר למודל תפקיד מומחה אם רלוונטי
-- 🔗 Chain of Thought: בקש שלבי חשיבה אם המשימה מורכבת
-- 📝 Few-Shot: הוסף דוגמה לפלט הרצוי אם לא ברור
-- 🎯 Constraints: הוסף מגבלות שמחדדות את המשימה
-- 📐 Structure: ארגן את הפרומפט במבנה ברור
-
-החזר רק את הפרומפט המשופר, ללא הסברים או הערות נוספות.
-הפרומפט צריך להיות מוכן לשימוש ישיר."""
+        refinement_prompt = self._build_refinement_prompt(
+            original_prompt, category, critique, user_answers
+        )
 
         try:
-            response = await self.model.generate_content_async(
+            response = await generate_with_fallback(
+                self.models,
                 refinement_prompt,
-                generation_config={
-                    "temperature": 0.4,  # מאוזן - לא יצירתי מדי, לא נוקשה מדי
-                    "max_output_tokens": 1000
-                }
+                generation_config=(
+                    _REFINE_GENERATION_CONFIG if temperature is None
+                    else {**_REFINE_GENERATION_CONFIG, "temperature": temperature}
+                )
             )
             
-            improved = response.text.strip()
-            
-            # נקה סימני קוד אם יש
-            improved = improved.strip('`').strip()
-            if improved.startswith('text\n'):
-                improved = improved[5:]
+            # נקה גדר קוד עוטפת אם יש (רק בתחילת/סוף התשובה, לא בתוכה)
+            improved = _FENCE_RE.sub('', response.text).strip()
             
+            if cache_key is not None:
+                self._cache.set(cache_key, improved)
             return improved
             
         except Exception as e:
             logger.error(f"Refinement failed: {e}")
             raise
     
+    async def refine_batch(
+        self,
+        jobs: List[Tuple[str, PromptCategory, CritiqueResult]]
+    ) -> List[str]:
+        """
+        משפר כמה פרומפטים יחד - כל הקריאות נשלחות במקביל.
+        
+        Args:
+            jobs: רשימת (פרומפט, קטגוריה, ביקורת)
+            
+        Returns:
+            רשימת פרומפטים משופרים, באותו סדר
+        """
+        return list(await asyncio.gather(*[
+            self.refine(original_prompt=prompt, category=category, critique=critique)
+            for prompt, category, critique in jobs
+        ]))
+    
+    async def refine_stream(
+        self,
+        original_prompt: str,
+        category: PromptCategory,
+        critique: CritiqueResult,
+        user_answers: Optional[dict] = None
+    ) -> AsyncIterator[str]:
+        """
+        כמו refine, אבל מחזיר את הפרומפט המשופר בחלקים תוך כדי יצירה.
+        מאפשר לממשק להציג את התוצאה בהדרגה במקום לחכות לתשובה המלאה.
+        
+        Yields:
+            חלקי טקסט של הפרומפט המשופר (ללא ניקוי סימני קוד)
+        """
+        refinement_prompt = self._build_refinement_prompt(
+            original_prompt, category, critique, user_answers
+        )
+        
+        try:
+            response = await generate_with_fallback(
+                self.models,
+                refinement_prompt,
+                generation_config=_REFINE_GENERATION_CONFIG,
+                stream=True
+            )
+            async for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+        except Exception as e:
+            logger.error(f"Streaming refinement failed: {e}")
+            raise
+    
+    def _build_refinement_prompt(
+        self,
+        original_prompt: str,
+        category: PromptCategory,
+        critique: CritiqueResult,
+        user_answers: Optional[dict] = None
+    ) -> str:
+        """בונה את פרומפט השיפור מהביקורת"""
+        return _REFINE_PROMPT_TMPL.substitute(
+            original_prompt=original_prompt,
+            category=category.value,
+            score=critique.overall_score,
+            weaknesses=self._format_weaknesses(critique.weaknesses),
+            missing_params=self._format_missing_params(critique.missing_params),
+            pro_tips=self._format_pro_tips(critique.pro_tips),
+            user_answers=self._format_user_answers(user_answers) if user_answers else ""
+        )
+    
     async def refine_iterative(
         self,
         original_prompt: str,
         category: PromptCategory,
         max_iterations: int = 3,
-        target_score: int = 8
-    ) -> tuple[str, int, List[CritiqueResult]]:
+        target_score: int = 8,
+        initial_critique: Optional[CritiqueResult] = None
+    ) -> tuple[str, int, List[CritiqueResult], CritiqueResult]:
         """
         שיפור איטרטיבי - ממשיך לשפר עד שמגיעים לציון יעד.
+        בכל איטרציה נוצרים כמה מועמדים במקביל (בטמפרטורות שונות),
+        כולם עוברים ביקורת במקביל, והטוב ביותר ממשיך הלאה.
         
         Args:
             original_prompt: הפרומפט המקורי
             category: הקטגוריה
             max_iterations: מקסימום איטרציות
             target_score: ציון יעד (עוצר כשמגיעים)
+            initial_critique: ביקורת קיימת על הפרומפט המקורי (חוסכת את הביקורת הראשונית)
             
         Returns:
-            tuple של (פרומפט משופר, מספר איטרציות, היסטוריית ביקורות)
+            tuple של (פרומפט משופר, מספר איטרציות, היסטוריית ביקורות, ביקורת סופית).
+            ההיסטוריה מכילה ביקורת אחת לכל איטרציה; הביקורת הסופית היא של הפרומפט המוחזר.
         """
-        from agents.shadow_critic import ShadowCritic
-        critic = ShadowCritic()
+        if self._critic is None:
+            self._critic = ShadowCritic()
+        critic = self._critic
         
         current_prompt = original_prompt
         critiques_history = []
         
+        # ביקורת ראשונית - אלא אם התקבלה כבר מבחוץ
+        critique = initial_critique or await critic.critique(current_prompt, category)
+        
         for iteration in range(max_iterations):
             logger.info(f"Iteration {iteration + 1}/{max_iterations}")
-            
-            # ביקורת
-            critique = await critic.critique(current_prompt, category)
             critiques_history.append(critique)
             
             logger.info(f"Score: {critique.overall_score}/10")
@@ -150,71 +284,75 @@ class PromptRefiner:
             # בדיקה אם הגענו ליעד
             if critique.overall_score >= target_score or critique.is_ready:
                 logger.info(f"Target reached at iteration {iteration + 1}")
-                return current_prompt, iteration + 1, critiques_history
+                return current_prompt, iteration + 1, critiques_history, critique
+            
+            # שיפור - כמה מועמדים במקביל
+            candidates = await asyncio.gather(*[
+                self.refine(
+                    original_prompt=current_prompt,
+                    category=category,
+                    critique=critique,
+                    temperature=t
+                )
+                for t in _CANDIDATE_TEMPERATURES
+            ], return_exceptions=True)
+            candidates = [c for c in candidates if not isinstance(c, BaseException)]
+            if not candidates:
+                raise RuntimeError("All refinement candidates failed")
             
-            # שיפור
-            current_prompt = await self.refine(
-                original_prompt=current_prompt,
-                category=category,
-                critique=critique
+            # ביקורת על כל המועמדים במקביל ובחירת הטוב ביותר
+            candidate_critiques = await asyncio.gather(*[
+                critic.critique(c, category) for c in candidates
+            ])
+            best = max(
+                range(len(candidates)),
+                key=lambda i: candidate_critiques[i].overall_score
             )
+            current_prompt, critique = candidates[best], candidate_critiques[best]
         
-        return current_prompt, max_iterations, critiques_history
+        # הביקורת של המועמד האחרון כבר קיימת - היא הביקורת הסופית
+        return current_prompt, max_iterations, critiques_history, critique
     
     def _format_weaknesses(self, weaknesses: List[Weakness]) -> str:
         """מעצב נקודות חולשה לטקסט"""
         if not weaknesses:
             return "לא זוהו נקודות חולשה משמעותיות"
         
-        lines = []
-        for i, w in enumerate(weaknesses, 1):
-            lines.append(f"{i}. [{w.type}] {w.description}")
-            lines.append(f"   הצעה: {w.suggestion}")
-        return "\n".join(lines)
+        return "\n".join(
+            f"{i}. [{w.type}] {w.description}\n   הצעה: {w.suggestion}"
+            for i, w in enumerate(weaknesses, 1)
+        )
     
     def _format_missing_params(self, params: List[MissingParameter]) -> str:
         """מעצב פרמטרים חסרים לטקסט"""
         if not params:
             return "לא זוהו פרמטרים חסרים קריטיים"
         
-        lines = []
-        for p in params:
-            importance = "חובה" if p.importance == "required" else "מומלץ"
-            lines.append(f"- {p.name} ({importance}): {p.question}")
-        return "\n".join(lines)
+        return "\n".join(
+            f"- {p.name} ({'חובה' if p.importance == 'required' else 'מומלץ'}): {p.question}"
+            for p in params
+        )
     
     def _format_pro_tips(self, tips: List[ProTip]) -> str:
         """מעצב טיפים מקצועיים לטקסט"""
         if not tips:
             return "לא זוהו טיפים ספציפיים"
         
-        technique_names = {
-            "role_playing": "הגדרת תפקיד",
-            "chain_of_thought": "חשיבה שלב-אחר-שלב",
-            "few_shot": "דוגמאות",
-            "constraints": "מגבלות",
-            "structure": "מבנה",
-            "creativity": "יצירתיות"
-        }
-        
-        lines = []
-        for i, tip in enumerate(tips, 1):
-            technique = technique_names.get(tip.technique, tip.technique)
-            lines.append(f"{i}. [{technique}] {tip.title}")
-            lines.append(f"   הצעה: {tip.suggestion}")
-            if tip.example:
-                lines.append(f"   דוגמה: \"{tip.example}\"")
-        return "\n".join(lines)
+        return "\n".join(
+            f"{i}. [{_TECHNIQUE_NAMES.get(tip.technique, tip.technique)}] {tip.title}\n"
+            f"   הצעה: {tip.suggestion}"
+            + (f"\n   דוגמה: \"{tip.example}\"" if tip.example else "")
+            for i, tip in enumerate(tips, 1)
+        )
     
     def _format_user_answers(self, answers: dict) -> str:
         """מעצב תשובות המשתמש"""
         if not answers:
             return ""
         
-        lines = ["תשובות המשתמש:"]
-        for key, value in answers.items():
-            lines.append(f"- {key}: {value}")
-        return "\n".join(lines)
+        return "תשובות המשתמש:\n" + "\n".join(
+            f"- {key}: {value}" for key, value in answers.items()
+        )
     
     async def generate_explanation(
         self,
@@ -225,31 +363,17 @@ class PromptRefiner:
         """
         מייצר הסבר בעברית על השיפורים שנעשו.
         """
-        explanation_prompt = f"""[הסבר שיפורים - עברית]
-
-פרומפט מקורי:
-"{original_prompt}"
-
-פרומפט משופר:
-"{improved_prompt}"
-
-נקודות חולשה שטופלו:
-{self._format_weaknesses(weaknesses)}
-
-כתוב הסבר קצר (3-5 משפטים) בעברית שמסביר:
-1. מה היו הבעיות העיקריות
-2. איך הפרומפט המשופר מטפל בהן
-3. למה זה ישפר את התוצאות
-
-שמור על טון ידידותי ומעודד. אל תהיה ביקורתי מדי."""
+        explanation_prompt = _EXPLANATION_PROMPT_TMPL.substitute(
+            original_prompt=original_prompt,
+            improved_prompt=improved_prompt,
+            weaknesses=self._format_weaknesses(weaknesses)
+        )
 
         try:
-            response = await self.model.generate_content_async(
+            response = await generate_with_fallback(
+                self.models,
                 explanation_prompt,
-                generation_config={
-                    "temperature": 0.5,
-                    "max_output_tokens": 300
-                }
+                generation_config=_EXPLANATION_GENERATION_CONFIG
             )
             return response.text.strip()
         except Exception as e:
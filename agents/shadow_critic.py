@@ -4,50 +4,58 @@ Shadow Critic Agent
 """
 import json
 import logging
-from typing import Optional
-import google.generativeai as genai
+from typing import List, Optional, TypedDict
 
-from config import config
-from core.models import CritiqueResult, Weakness, MissingParameter, ProTip, PromptCategory
+from core.models import CritiqueResult, Weakness, PromptCategory
+from agents._client import get_models, generate_json, generate_with_fallback
+from agents._cache import PromptCache, normalize_prompt, prompt_key
 
 logger = logging.getLogger(__name__)
 
+# סכמת התשובה - נשלחת ל-Gemini כ-response_schema, כך שהמבנה נאכף בצד המודל
+class _WeaknessSchema(TypedDict):
+    type: str
+    description: str
+    suggestion: str
+    severity: str
 
-class ShadowCritic:
-    """
-    סוכן ביקורת פנימי שמנתח פרומפטים ומזהה בעיות פוטנציאליות.
-    משתמש במודל זול ומהיר (Gemini Flash) לחיסכון בעלויות.
-    """
-    
-    def __init__(self):
-        genai.configure(api_key=config.GEMINI_API_KEY)
-        self.model = genai.GenerativeModel('gemini-2.0-flash')
-        
-    async def critique(
-        self, 
-        prompt: str, 
-        category: Optional[PromptCategory] = None
-    ) -> CritiqueResult:
-        """
-        מבצע ביקורת על פרומפט ומחזיר נקודות חולשה והצעות לשיפור.
-        
-        Args:
-            prompt: הפרומפט לביקורת
-            category: קטגוריה (אופציונלי - אם לא סופק, יזהה אוטומטית)
-        
-        Returns:
-            CritiqueResult עם כל הממצאים
-        """
-        category_context = f"קטגוריה: {category.value}" if category else "קטגוריה: לא ידועה"
-        
-        critique_prompt = f"""[מצב מאמן פרומפטים מקצועי - עברית]
 
-אתה מאמן פרומפטים מומחה. התפקיד שלך הוא לא רק למצוא בעיות, אלא בעיקר **להציע רעיונות יצירתיים** שישדרגו את הפרומפט לרמה מקצועית יותר.
+class _MissingParamSchema(TypedDict):
+    name: str
+    question: str
+    importance: str
 
-פרומפט לניתוח:
-"{prompt}"
 
-{category_context}
+class _ProTipSchema(TypedDict):
+    technique: str
+    title: str
+    suggestion: str
+    example: str
+    impact: str
+
+
+class _CritiqueSchema(TypedDict):
+    weaknesses: List[_WeaknessSchema]
+    missing_params: List[_MissingParamSchema]
+    pro_tips: List[_ProTipSchema]
+    overall_score: int
+    is_ready: bool
+
+
+_CRITIQUE_GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": _CritiqueSchema,
+    "temperature": 0.3  # נמוך יותר = יותר עקבי
+}
+
+_QUICK_SCORE_GENERATION_CONFIG = {"temperature": 0.1}
+
+# הוראות הביקורת הקבועות - נשלחות כ-system instruction של המודל,
+# כך שכל בקשה נושאת רק את הפרומפט והקטגוריה
+_CRITIQUE_SYSTEM_INSTRUCTION = """[מצב מאמן פרומפטים מקצועי - עברית]
+
+אתה מאמן פרומפטים מומחה. התפקיד שלך הוא לא רק למצוא בעיות, אלא בעיקר **להציע רעיונות יצירתיים** שישדרגו את הפרומפט לרמה מקצועית יותר.
+בכל הודעה תקבל פרומפט לניתוח ואת הקטגוריה שלו.
 
 ## חלק 1: זיהוי בעיות (אם יש)
 זהה נקודות חולשה ב-5 קטגוריות:
@@ -71,35 +79,14 @@ class ShadowCritic:
 
 פנה ישירות למשתמש בגוף שני ("אתה", "לך"), לא בגוף שלישי.
 
-החזר תשובה בפורמט JSON בלבד:
-{{
-    "weaknesses": [
-        {{
-            "type": "ambiguity|context|assumption|format|specificity",
-            "description": "תיאור הבעיה בעברית",
-            "suggestion": "הצעה לתיקון",
-            "severity": "low|medium|high"
-        }}
-    ],
-    "missing_params": [
-        {{
-            "name": "שם הפרמטר",
-            "question": "שאלה למשתמש בעברית",
-            "importance": "required|recommended"
-        }}
-    ],
-    "pro_tips": [
-        {{
-            "technique": "role_playing|chain_of_thought|few_shot|constraints|structure|creativity",
-            "title": "כותרת קצרה וקליטה",
-            "suggestion": "הסבר מלא של ההצעה",
-            "example": "דוגמה קונקרטית איך זה ייראה בפרומפט",
-            "impact": "low|medium|high"
-        }}
-    ],
-    "overall_score": 1-10,
-    "is_ready": true/false
-}}
+ערכים מותרים בשדות התשובה (מבנה ה-JSON נאכף בסכמה):
+- weaknesses.type: ambiguity|context|assumption|format|specificity
+- weaknesses.severity: low|medium|high
+- missing_params.importance: required|recommended
+- pro_tips.technique: role_playing|chain_of_thought|few_shot|constraints|structure|creativity
+- pro_tips.impact: low|medium|high
+- overall_score: 1-10
+- כל הטקסטים (description, suggestion, question, title, example) בעברית
 
 הערות:
 - **חובה לתת לפחות 2 pro_tips** גם אם הפרומפט טוב
@@ -109,29 +96,140 @@ class ShadowCritic:
 - ציון 5-6 = צריך שיפור משמעותי
 - ציון 1-4 = צריך לשכתב מחדש"""
 
+# החלק המשתנה של כל בקשת ביקורת - placeholders בלבד, בלי טקסט מחושב
+_CRITIQUE_USER_TEMPLATE = """פרומפט לניתוח:
+"{prompt}"
+
+קטגוריה: {category}"""
+
+_QUICK_SCORE_TEMPLATE = """[ציון מהיר]
+דרג את הפרומפט הבא מ-1 עד 10 לפי:
+- בהירות (clarity)
+- ספציפיות (specificity)  
+- שלמות (completeness)
+
+פרומפט: "{prompt}"
+
+החזר רק מספר בין 1 ל-10, ללא הסברים."""
+
+# גבולות אורך - מחוץ להם מחזירים ביקורת קבועה בלי קריאה למודל
+_MIN_PROMPT_CHARS = 5
+_MAX_PROMPT_CHARS = 20_000
+
+_EMPTY_CRITIQUE = CritiqueResult(
+    weaknesses=[Weakness(
+        type="specificity",
+        description="הפרומפט קצר מדי",
+        suggestion="תאר מה אתה רוצה לקבל: מטרה, הקשר ופורמט הפלט",
+        severity="high"
+    )],
+    overall_score=1,
+    is_ready=False
+)
+
+_TOO_LONG_CRITIQUE = CritiqueResult(
+    weaknesses=[Weakness(
+        type="format",
+        description="הפרומפט ארוך מדי לניתוח",
+        suggestion="פצל אותו לכמה פרומפטים קצרים וממוקדים",
+        severity="high"
+    )],
+    overall_score=1,
+    is_ready=False
+)
+
+# אייקונים לתצוגת הביקורת - משותפים גם לעיצוב ה-MarkdownV2 של הבוט
+TECHNIQUE_ICONS = {
+    "role_playing": "🎭",
+    "chain_of_thought": "🔗",
+    "few_shot": "📝",
+    "constraints": "🎯",
+    "structure": "📐",
+    "creativity": "💡"
+}
+SEVERITY_ICONS = {"high": "🔴", "medium": "🟡", "low": "⚪"}
+IMPACT_STARS = {"high": "⭐⭐⭐", "medium": "⭐⭐", "low": "⭐"}
+IMPORTANCE_ICONS = {"required": "❗"}
+
+_READY_LINE = "✅ הפרומפט מוכן לשימוש!\n"
+_NOT_READY_LINE = "⚠️ מומלץ לשפר את הפרומפט\n"
+
+
+def _copy_critique(critique: CritiqueResult) -> CritiqueResult:
+    """
+    עותק בטוח לשיתוף: הפריטים עצמם (Weakness וכו') קפואים,
+    אז מספיק להעתיק את הרשימות - בלי deep copy לכל פריט.
+    """
+    return critique.model_copy(update={
+        "weaknesses": list(critique.weaknesses),
+        "missing_params": list(critique.missing_params),
+        "pro_tips": list(critique.pro_tips)
+    })
+
+
+def score_emoji(score: int) -> str:
+    """אייקון לפי ציון"""
+    return "🟢" if score >= 7 else "🟡" if score >= 5 else "🔴"
+
+
+class ShadowCritic:
+    """
+    סוכן ביקורת פנימי שמנתח פרומפטים ומזהה בעיות פוטנציאליות.
+    משתמש במודל זול ומהיר (Gemini Flash) לחיסכון בעלויות.
+    """
+    
+    # מטמון ביקורות משותף לכל המופעים (גם לזה שבתוך ה-refiner)
+    _cache = PromptCache(maxsize=1024)
+    
+    def __init__(self):
+        self.models = get_models()
+        # קריאה נפרדת לכל ביקורת - פרומפטים של משתמשים שונים לא חולקים הקשר אחד
+        self.critique_models = get_models(_CRITIQUE_SYSTEM_INSTRUCTION)
+        
+    async def critique(
+        self, 
+        prompt: str, 
+        category: Optional[PromptCategory] = None
+    ) -> CritiqueResult:
+        """
+        מבצע ביקורת על פרומפט ומחזיר נקודות חולשה והצעות לשיפור.
+        
+        Args:
+            prompt: הפרומפט לביקורת
+            category: קטגוריה (אופציונלי - אם לא סופק, יזהה אוטומטית)
+        
+        Returns:
+            CritiqueResult עם כל הממצאים
+        """
+        # קלט ריק/טריוויאלי או ענק - תשובה קבועה, בלי קריאה למודל
+        length = len(prompt.strip())
+        if length < _MIN_PROMPT_CHARS:
+            return _copy_critique(_EMPTY_CRITIQUE)
+        if length > _MAX_PROMPT_CHARS:
+            return _copy_critique(_TOO_LONG_CRITIQUE)
+        
+        # מטמון לפי (קטגוריה, פרומפט מנורמל) - כמעט-כפילויות לא עולות קריאה ל-LLM
+        cache_key = prompt_key(category.value if category else "", normalize_prompt(prompt))
+        cached = ShadowCritic._cache.get(cache_key)
+        if cached is not None:
+            return _copy_critique(cached)
+        
+        critique_prompt = _CRITIQUE_USER_TEMPLATE.format_map({
+            "prompt": prompt,
+            "category": category.value if category else "לא ידועה"
+        })
+
         try:
-            response = await self.model.generate_content_async(
+            result = await generate_json(
+                self.critique_models,
                 critique_prompt,
-                generation_config={
-                    "response_mime_type": "application/json",
-                    "temperature": 0.3  # נמוך יותר = יותר עקבי
-                }
+                _CRITIQUE_GENERATION_CONFIG
             )
             
-            result = json.loads(response.text)
-            
-            # המרה למודלים
-            weaknesses = [Weakness(**w) for w in result.get("weaknesses", [])]
-            missing_params = [MissingParameter(**p) for p in result.get("missing_params", [])]
-            pro_tips = [ProTip(**t) for t in result.get("pro_tips", [])]
-            
-            return CritiqueResult(
-                weaknesses=weaknesses,
-                missing_params=missing_params,
-                pro_tips=pro_tips,
-                overall_score=result.get("overall_score", 5),
-                is_ready=result.get("is_ready", False)
-            )
+            # המרה למודלים - ולידציה אחת של כל המבנה (כולל הרשימות המקוננות)
+            critique = CritiqueResult.model_validate(result)
+            ShadowCritic._cache.set(cache_key, _copy_critique(critique))
+            return critique
             
         except json.JSONDecodeError as e:
             logger.error(f"Failed to parse critique response: {e}")
@@ -155,80 +253,82 @@ class ShadowCritic:
         ציון מהיר לפרומפט (1-10) בלי ניתוח מלא.
         שימושי להשוואה לפני/אחרי שיפור.
         """
-        score_prompt = f"""[ציון מהיר]
-דרג את הפרומפט הבא מ-1 עד 10 לפי:
-- בהירות (clarity)
-- ספציפיות (specificity)  
-- שלמות (completeness)
-
-פרומפט: "{prompt}"
-
-החזר רק מספר בין 1 ל-10, ללא הסברים."""
+        # פרומפטים טריוויאליים לא צריכים קריאה למודל
+        heuristic = self._heuristic_score(prompt)
+        if heuristic is not None:
+            return heuristic
+        
+        score_prompt = _QUICK_SCORE_TEMPLATE.format_map({"prompt": prompt})
 
         try:
-            response = await self.model.generate_content_async(
+            response = await generate_with_fallback(
+                self.models,
                 score_prompt,
-                generation_config={"temperature": 0.1}
+                generation_config=_QUICK_SCORE_GENERATION_CONFIG
             )
             score = int(response.text.strip())
             return max(1, min(10, score))
         except:
             return 5  # fallback
 
+    def _heuristic_score(self, prompt: str) -> Optional[int]:
+        """
+        ציון לקסיקלי זול לפרומפטים שהציון שלהם ברור מראש.
+        מחזיר None כשאין ודאות - ואז מחליט המודל.
+        """
+        text = prompt.strip()
+        if len(text) < 15:
+            return 2
+        if len(text) < 40 and '?' not in text and ':' not in text:
+            return 4
+        return None
+
     def format_critique_hebrew(self, critique: CritiqueResult) -> str:
         """
-        מעצב את הביקורת לתצוגה יפה בעברית (לטלגרם).
+        מעצב את הביקורת לתצוגה יפה בעברית (טקסט רגיל, כמו שמוחזר ב-API).
+        הבוט מעצב את אותה ביקורת ל-MarkdownV2 בנפרד.
         """
-        lines = []
-        
-        # ציון כללי
-        score_emoji = "🟢" if critique.overall_score >= 7 else "🟡" if critique.overall_score >= 5 else "🔴"
-        lines.append(f"{score_emoji} **ציון כללי: {critique.overall_score}/10**\n")
-        
-        # סטטוס
-        if critique.is_ready:
-            lines.append("✅ הפרומפט מוכן לשימוש!\n")
-        else:
-            lines.append("⚠️ מומלץ לשפר את הפרומפט\n")
+        # כל סעיף נבנה כמחרוזת אחת מ-generator, ואז חיבור יחיד בסוף
+        sections = [
+            # ציון כללי
+            f"{score_emoji(critique.overall_score)} **ציון כללי: {critique.overall_score}/10**\n",
+            # סטטוס
+            _READY_LINE if critique.is_ready else _NOT_READY_LINE
+        ]
         
         # נקודות חולשה (אם יש)
         if critique.weaknesses:
-            lines.append("**🔍 נקודות לתיקון:**\n")
-            for i, w in enumerate(critique.weaknesses, 1):
-                severity_icon = "🔴" if w.severity == "high" else "🟡" if w.severity == "medium" else "⚪"
-                lines.append(f"{i}. {severity_icon} **{w.type}**")
-                lines.append(f"   {w.description}")
-                lines.append(f"   💡 *{w.suggestion}*\n")
+            sections.append("\n".join((
+                "**🔍 נקודות לתיקון:**\n",
+                *(
+                    f"{i}. {SEVERITY_ICONS.get(w.severity, '⚪')} **{w.type}**\n"
+                    f"   {w.description}\n"
+                    f"   💡 *{w.suggestion}*\n"
+                    for i, w in enumerate(critique.weaknesses, 1)
+                )
+            )))
         
         # טיפים מקצועיים לשדרוג (החלק החשוב!)
         if critique.pro_tips:
-            lines.append("**🚀 רעיונות לשדרוג הפרומפט:**\n")
-            
-            technique_icons = {
-                "role_playing": "🎭",
-                "chain_of_thought": "🔗",
-                "few_shot": "📝",
-                "constraints": "🎯",
-                "structure": "📐",
-                "creativity": "💡"
-            }
-            
-            for i, tip in enumerate(critique.pro_tips, 1):
-                icon = technique_icons.get(tip.technique, "💡")
-                impact_stars = "⭐⭐⭐" if tip.impact == "high" else "⭐⭐" if tip.impact == "medium" else "⭐"
-                
-                lines.append(f"{i}. {icon} **{tip.title}** {impact_stars}")
-                lines.append(f"   {tip.suggestion}")
-                if tip.example:
-                    lines.append(f"   📌 _דוגמה: \"{tip.example}\"_\n")
-                else:
-                    lines.append("")
+            sections.append("\n".join((
+                "**🚀 רעיונות לשדרוג הפרומפט:**\n",
+                *(
+                    f"{i}. {TECHNIQUE_ICONS.get(tip.technique, '💡')} **{tip.title}** "
+                    f"{IMPACT_STARS.get(tip.impact, '⭐')}\n"
+                    f"   {tip.suggestion}\n"
+                    + (f"   📌 _דוגמה: \"{tip.example}\"_\n" if tip.example else "")
+                    for i, tip in enumerate(critique.pro_tips, 1)
+                )
+            )))
         
         # פרמטרים חסרים (בסוף, פחות חשוב)
         if critique.missing_params:
-            lines.append("**❓ שאלות להשלמה:**\n")
-            for p in critique.missing_params:
-                importance_icon = "❗" if p.importance == "required" else "💭"
-                lines.append(f"{importance_icon} {p.question}")
+            sections.append("\n".join((
+                "**❓ שאלות להשלמה:**\n",
+                *(
+                    f"{IMPORTANCE_ICONS.get(p.importance, '💭')} {p.question}"
+                    for p in critique.missing_params
+                )
+            )))
         
-        return "\n".join(lines)
+        return "\n".join(sections)
@@ -1,17 +1,19 @@
 """
 Prompt Enhancer - Main Application
-Flask app with Telegram webhook and Web API
+Quart (async Flask) app with Telegram webhook and Web API
 """
 import asyncio
 import logging
-import threading
-from flask import Flask, request, jsonify, render_template
+import orjson
+from pydantic import BaseModel
+from quart import Quart, request, jsonify, render_template
 from telegram import Update
 
 from config import config
 from bot import create_bot, setup_webhook
+from core.models import PromptCategory
 from core.orchestrator import orchestrator
-from database.mongodb import MongoDB
+from database.mongodb import db
 
 # ========== Logging Setup ==========
 logging.basicConfig(
@@ -20,48 +22,59 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# ========== Flask App ==========
-app = Flask(__name__)
+# ========== Quart App ==========
+# Quart = Flask אסינכרוני: ה-routes מחכים ל-orchestrator ישירות על ה-loop של השרת
+app = Quart(__name__)
 
-# Global bot application
-bot_app = None
-bot_initialized = False
 
-# ========== Persistent Event Loop ==========
-# Event loop קבוע שרץ ברקע - פותר את בעיית "Event loop is closed"
-_loop = None
-_loop_thread = None
+def _json_default(obj):
+    """מודלים של pydantic מסודרים ישירות - בלי model_dump מראש בכל route"""
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
 
 
-def get_event_loop():
-    """קבלת event loop קבוע שרץ ברקע"""
-    global _loop, _loop_thread
-    
-    if _loop is None or _loop.is_closed():
-        _loop = asyncio.new_event_loop()
-        _loop_thread = threading.Thread(target=_loop.run_forever, daemon=True)
-        _loop_thread.start()
-        logger.info("Created new persistent event loop")
-    
-    return _loop
+def json_response(obj, status: int = 200):
+    """תגובת JSON מהירה עם orjson (במקום jsonify)"""
+    return app.response_class(
+        orjson.dumps(obj, default=_json_default, option=orjson.OPT_NON_STR_KEYS),
+        status=status,
+        mimetype="application/json"
+    )
 
+# Global bot application
+bot_app = None
+bot_initialized = False
+# מונע אתחול כפול כששני webhooks מגיעים יחד בעליה קרה
+_bot_init_lock = asyncio.Lock()
 
-def run_async(coro):
-    """הרצת coroutine על ה-event loop הקבוע"""
-    loop = get_event_loop()
-    future = asyncio.run_coroutine_threadsafe(coro, loop)
-    return future.result(timeout=120)  # timeout של 2 דקות
+async def initialize_bot():
+    """Initialize and start the bot application (webhook and polling)"""
+    global bot_initialized
+    if bot_initialized:
+        return bot_app
+    async with _bot_init_lock:
+        bot = get_bot()
+        if not bot_initialized:
+            await bot.initialize()
+            # start - בלעדיו handlers עם block=False רצים כמשימות שאף אחד לא מחכה להן
+            await bot.start()
+            bot_initialized = True
+    return bot
 
 
-async def initialize_bot():
-    """Initialize bot application for webhook mode"""
-    global bot_app, bot_initialized
-    if bot_app is None:
-        bot_app = create_bot()
+async def shutdown_bot():
+    """עצירת הבוט - stop מחכה ל-handlers שעוד רצים לפני shutdown"""
+    global bot_initialized
     if not bot_initialized:
-        await bot_app.initialize()
-        bot_initialized = True
-    return bot_app
+        return
+    bot = get_bot()
+    if bot.updater and bot.updater.running:
+        await bot.updater.stop()
+    if bot.running:
+        await bot.stop()
+    await bot.shutdown()
+    bot_initialized = False
 
 
 def get_bot():
@@ -74,13 +87,13 @@ def get_bot():
 
 # ========== Health Check ==========
 @app.route("/")
-def index():
+async def index():
     """דף בית / בדיקת תקינות"""
-    return render_template("index.html")
+    return await render_template("index.html")
 
 
 @app.route("/health")
-def health():
+async def health():
     """Health check לפנקי מערכות ניטור ו-Render"""
     return jsonify({
         "status": "healthy",
@@ -91,49 +104,34 @@ def health():
 
 # ========== Telegram Webhook ==========
 @app.route("/webhook", methods=["POST"])
-def telegram_webhook():
+async def telegram_webhook():
     """Webhook endpoint לטלגרם"""
-    print("=== WEBHOOK RECEIVED ===", flush=True)
     logger.info("Webhook received")
     try:
-        data = request.get_json()
-        print(f"=== WEBHOOK DATA: {data} ===", flush=True)
-        logger.info(f"Webhook data: {data}")
-
-        async def process():
-            print("=== STARTING ASYNC PROCESS ===", flush=True)
-            logger.info("Starting async process")
-            bot = await initialize_bot()
-            print("=== BOT INITIALIZED ===", flush=True)
-            logger.info("Bot initialized")
-            update = Update.de_json(data, bot.bot)
-            print(f"=== UPDATE PARSED: {update} ===", flush=True)
-            logger.info(f"Update parsed: {update}")
-            await bot.process_update(update)
-            print("=== UPDATE PROCESSED ===", flush=True)
-            logger.info("Update processed")
-
-        # שימוש ב-event loop קבוע במקום asyncio.run() שסוגר את ה-loop
-        run_async(process())
-
-        print("=== WEBHOOK COMPLETED ===", flush=True)
+        data = await request.get_json()
+        # פירוט מלא רק ב-DEBUG - בלי לעצב את כל ה-payload בכל בקשה
+        logger.debug("Webhook data: %s", data)
+
+        bot = await initialize_bot()
+        update = Update.de_json(data, bot.bot)
+        logger.debug("Update parsed: %s", update)
+        await bot.process_update(update)
         logger.info("Webhook completed successfully")
         return jsonify({"status": "ok"})
     except Exception as e:
-        print(f"=== WEBHOOK ERROR: {e} ===", flush=True)
         logger.error(f"Webhook error: {e}", exc_info=True)
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
 @app.route("/set-webhook", methods=["POST"])
-def set_webhook():
+async def set_webhook():
     """הגדרת webhook (להרצה חד-פעמית)"""
     if not config.WEBHOOK_URL:
         return jsonify({"error": "WEBHOOK_URL not configured"}), 400
     
     try:
         bot = get_bot()
-        run_async(setup_webhook(bot, config.WEBHOOK_URL))
+        await setup_webhook(bot, config.WEBHOOK_URL)
         return jsonify({"status": "webhook set", "url": config.WEBHOOK_URL})
     except Exception as e:
         logger.error(f"Set webhook error: {e}")
@@ -142,7 +140,7 @@ def set_webhook():
 
 # ========== REST API ==========
 @app.route("/api/analyze", methods=["POST"])
-def api_analyze():
+async def api_analyze():
     """
     API לניתוח פרומפט
     
@@ -152,7 +150,7 @@ def api_analyze():
     Response:
         {"category": "...", "critique": {...}, "questions": [...]}
     """
-    data = request.get_json()
+    data = await request.get_json()
     
     if not data or "prompt" not in data:
         return jsonify({"error": "Missing 'prompt' field"}), 400
@@ -161,17 +159,17 @@ def api_analyze():
     user_id = data.get("user_id", "api_user")
     
     try:
-        result = run_async(orchestrator.analyze_prompt(prompt, user_id))
+        result = await orchestrator.analyze_prompt(prompt, user_id)
         
         # המרה לפורמט JSON-friendly
-        return jsonify({
+        return json_response({
             "original_prompt": result["original_prompt"],
             "category": result["category"].value,
             "category_description": result["category_description"],
             "confidence": result["confidence"],
             "critique": {
-                "weaknesses": [w.model_dump() for w in result["critique"].weaknesses],
-                "missing_params": [p.model_dump() for p in result["critique"].missing_params],
+                "weaknesses": result["critique"].weaknesses,
+                "missing_params": result["critique"].missing_params,
                 "overall_score": result["critique"].overall_score,
                 "is_ready": result["critique"].is_ready
             },
@@ -184,7 +182,7 @@ def api_analyze():
 
 
 @app.route("/api/improve", methods=["POST"])
-def api_improve():
+async def api_improve():
     """
     API לשיפור פרומפט
     
@@ -199,7 +197,7 @@ def api_improve():
     Response:
         {"original": "...", "improved": "...", "explanation": "...", ...}
     """
-    data = request.get_json()
+    data = await request.get_json()
     
     if not data or "prompt" not in data:
         return jsonify({"error": "Missing 'prompt' field"}), 400
@@ -210,14 +208,14 @@ def api_improve():
     max_iterations = data.get("max_iterations", config.MAX_ITERATIONS)
     
     try:
-        result = run_async(orchestrator.refine_prompt(
+        result = await orchestrator.refine_prompt(
             prompt=prompt,
             user_id=user_id,
             user_answers=user_answers,
             max_iterations=max_iterations
-        ))
+        )
         
-        return jsonify({
+        return json_response({
             "original_prompt": result.original_prompt,
             "improved_prompt": result.improved_prompt,
             "category": result.category.value,
@@ -226,7 +224,7 @@ def api_improve():
             "improvement_delta": result.improvement_delta,
             "explanation": result.explanation,
             "critique": {
-                "weaknesses": [w.model_dump() for w in result.critique.weaknesses],
+                "weaknesses": result.critique.weaknesses,
                 "overall_score": result.critique.overall_score,
                 "is_ready": result.critique.is_ready
             }
@@ -237,7 +235,7 @@ def api_improve():
 
 
 @app.route("/api/quick-critique", methods=["POST"])
-def api_quick_critique():
+async def api_quick_critique():
     """
     API לביקורת מהירה (טקסט בלבד)
     
@@ -247,77 +245,103 @@ def api_quick_critique():
     Response:
         {"critique": "טקסט מעוצב בעברית"}
     """
-    data = request.get_json()
+    data = await request.get_json()
     
     if not data or "prompt" not in data:
         return jsonify({"error": "Missing 'prompt' field"}), 400
     
     try:
-        critique = run_async(orchestrator.quick_critique(data["prompt"]))
-        return jsonify({"critique": critique})
+        critique = await orchestrator.quick_critique(data["prompt"])
+        return json_response({"critique": critique})
     except Exception as e:
         logger.error(f"API quick-critique error: {e}")
         return jsonify({"error": str(e)}), 500
 
 
 @app.route("/api/stats", methods=["GET"])
-def api_stats():
+async def api_stats():
     """סטטיסטיקות המערכת"""
     try:
-        db = MongoDB()
-        stats = run_async(db.get_stats())
-        return jsonify(stats)
+        stats = await db.get_stats()
+        return json_response(stats)
     except Exception as e:
         logger.error(f"API stats error: {e}")
         return jsonify({"error": str(e)}), 500
 
 
 @app.route("/api/examples", methods=["GET"])
-def api_examples():
+async def api_examples():
     """דוגמאות קהילתיות"""
+    category = request.args.get("category")
+    if category:
+        try:
+            category = PromptCategory(category)
+        except ValueError:
+            return jsonify({"error": f"Unknown category '{category}'"}), 400
+    
     try:
-        category = request.args.get("category")
         limit = int(request.args.get("limit", 5))
         
-        examples = run_async(orchestrator.get_community_examples(
+        examples = await orchestrator.get_community_examples(
             category=category,
             limit=limit
-        ))
-        return jsonify({"examples": examples})
+        )
+        return json_response({"examples": examples})
     except Exception as e:
         logger.error(f"API examples error: {e}")
         return jsonify({"error": str(e)}), 500
 
 
 # ========== Startup ==========
-@app.before_request
-def startup_tasks():
-    """משימות הפעלה ראשונה - אינדקסים ו-webhook"""
+@app.before_serving
+async def startup_tasks():
+    """משימות הפעלה - אינדקסים ו-webhook, פעם אחת לפני קבלת בקשות"""
     # יצירת אינדקסים
-    if not hasattr(app, '_indexes_created'):
-        try:
-            db = MongoDB()
-            run_async(db.ensure_indexes())
-            app._indexes_created = True
-            logger.info("Database indexes ensured")
-        except Exception as e:
-            logger.error(f"Failed to create indexes: {e}")
+    try:
+        await db.ensure_indexes()
+        logger.info("Database indexes ensured")
+    except Exception as e:
+        logger.error(f"Failed to create indexes: {e}")
+
+    # מסמך הסיכום - בנפרד מהאינדקסים; אם נכשל, get_stats ינסה לבנות אותו שוב
+    try:
+        await db.ensure_stats_summary()
+    except Exception as e:
+        logger.error(f"Failed to build stats summary: {e}")
 
     # רישום webhook
-    if not hasattr(app, '_webhook_set') and config.WEBHOOK_URL:
+    if config.WEBHOOK_URL:
         try:
             bot = get_bot()
             webhook_url = f"{config.WEBHOOK_URL}/webhook"
-            run_async(bot.bot.set_webhook(url=webhook_url))
-            app._webhook_set = True
+            await bot.bot.set_webhook(url=webhook_url)
             logger.info(f"Webhook registered: {webhook_url}")
-            print(f"=== WEBHOOK REGISTERED: {webhook_url} ===", flush=True)
         except Exception as e:
             logger.error(f"Failed to set webhook: {e}")
-            print(f"=== WEBHOOK REGISTRATION FAILED: {e} ===", flush=True)
+
+
+@app.after_serving
+async def shutdown_tasks():
+    """עצירת הבוט ואז כתיבת ההיסטוריה שעוד בתור - לפני סגירת השרת"""
+    # קודם הבוט: handlers שעוד רצים מסיימים ומכניסים את ההיסטוריה שלהם לתור
+    await shutdown_bot()
+    await db.flush_history()
 
 
 # ========== Main ==========
+async def run_polling_with_server():
+    """
+    מצב פיתוח: polling של הבוט ושרת ה-API על אותו event loop.
+    """
+    bot = await initialize_bot()
+    await bot.updater.start_polling(allowed_updates=["message", "callback_query"])
+    try:
+        await app.run_task(host="0.0.0.0", port=config.PORT)
+    finally:
+        # בדרך כלל כבר נעשה ב-after_serving; כאן למקרה שהשרת לא עלה בכלל
+        await shutdown_bot()
+
+
 if __name__ == "__main__":
     # בדיקה אם להריץ במצב webhook או polling
     if config.WEBHOOK_URL:
@@ -327,15 +351,9 @@ if __name__ == "__main__":
     else:
         # Development mode with polling
         logger.info("Starting in polling mode (development)")
-        from bot import run_polling
-        
-        # הרצת Flask ב-thread נפרד
-        import threading
-        flask_thread = threading.Thread(
-            target=lambda: app.run(host="0.0.0.0", port=config.PORT, debug=False)
-        )
-        flask_thread.daemon = True
-        flask_thread.start()
-        
-        # הרצת הבוט במצב polling
-        run_polling()
+        try:
+            import uvloop
+            uvloop.install()
+        except ImportError:
+            pass  # uvloop לא זמין (למשל Windows) - asyncio רגיל
+        asyncio.run(run_polling_with_server())
@@ -4,6 +4,8 @@ Telegram Bot for Prompt Enhancer
 """
 import logging
 import asyncio
+from contextlib import asynccontextmanager
+from functools import lru_cache
 from typing import Optional
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
@@ -11,20 +13,22 @@ from telegram.ext import (
     CallbackQueryHandler, ContextTypes, filters
 )
 from telegram.constants import ParseMode
+from telegram.request import HTTPXRequest
 
 from config import config
+from agents.shadow_critic import (
+    IMPACT_STARS, IMPORTANCE_ICONS, SEVERITY_ICONS, TECHNIQUE_ICONS, score_emoji
+)
 from core.orchestrator import orchestrator
-from core.models import UserSession
-from database.mongodb import MongoDB
+from core.models import CritiqueResult, PromptCategory, UserSession
+from core.markdown import escape_md, escape_md_code, render_md, validate_md
+from database.mongodb import db
 
 logger = logging.getLogger(__name__)
 
-# ========== Handlers ==========
+# ========== Static Messages ==========
 
-async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """פקודת /start"""
-    logger.info(f"start_command called by user {update.effective_user.id}")
-    welcome_message = """🚀 **ברוכים הבאים ל-Prompt Enhancer!**
+WELCOME_MESSAGE = validate_md(render_md("""🚀 **ברוכים הבאים ל-Prompt Enhancer!**
 
 אני עוזר לך לשפר פרומפטים ל-AI בעברית.
 
@@ -40,23 +44,9 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /examples - דוגמאות לשיפורים טובים
 /help - עזרה
 
-**התחל עכשיו - פשוט שלח פרומפט!** ✨"""
-
-    try:
-        await update.message.reply_text(
-            welcome_message,
-            parse_mode=ParseMode.MARKDOWN
-        )
-        logger.info("start_command reply sent successfully")
-    except Exception as e:
-        logger.error(f"start_command failed to send reply: {e}", exc_info=True)
-        # נסה בלי markdown אם יש בעיה
-        await update.message.reply_text(welcome_message)
+**התחל עכשיו - פשוט שלח פרומפט!** ✨"""))
 
-
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """פקודת /help"""
-    help_text = """📖 **מדריך שימוש**
+HELP_TEXT = validate_md(render_md("""📖 **מדריך שימוש**
 
 **מצב ברירת מחדל - ניתוח:**
 פשוט שלח פרומפט ואקבל:
@@ -80,23 +70,71 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 ✅ "כתוב קוד Python Flask לאתר portfolio עם 3 עמודים: בית, אודות, צור קשר. השתמש ב-Bootstrap 5 לעיצוב. הקוד צריך לכלול תיקיית templates."
 
 **משוב:**
-לאחר כל שיפור, דרג את התוצאה 1-5 ⭐"""
-    
+לאחר כל שיפור, דרג את התוצאה 1-5 ⭐"""))
+
+
+# כותרת הקטגוריה בהודעת הניתוח - כבר בפורמט MarkdownV2
+_CATEGORY_HEADERS = {
+    c: f"*{escape_md(orchestrator.category_router.get_category_description(c))}*\n\n"
+    for c in PromptCategory
+}
+
+
+@lru_cache(maxsize=1024)
+def _improve_keyboard(user_id: str) -> InlineKeyboardMarkup:
+    """כפתור שיפור אוטומטי - אובייקטי PTB אינם ניתנים לשינוי, אז בטוח לשתף אותם"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("✨ שפר אוטומטית", callback_data=f"improve:{user_id}")]
+    ])
+
+
+@lru_cache(maxsize=1024)
+def _rating_keyboard(user_id: str) -> InlineKeyboardMarkup:
+    """כפתורי משוב (דירוג 1-5 + העתקה) למשתמש"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(f"⭐{i}", callback_data=f"rate:{i}:{user_id}") for i in range(1, 6)],
+        [InlineKeyboardButton("📋 העתק", callback_data=f"copy:{user_id}")]
+    ])
+
+
+def _trunc(text: str, limit: int) -> str:
+    """קיצור טקסט לתצוגה, עם ... כשנחתך"""
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+def _command_tail(text: str) -> str:
+    """הטקסט שאחרי הפקודה, כמו שנכתב (כולל שורות ורווחים מקוריים)"""
+    parts = text.split(None, 1)
+    return parts[1] if len(parts) > 1 else ""
+
+
+# ========== Handlers ==========
+
+async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """פקודת /start"""
+    logger.info("start_command called by user %s", update.effective_user.id)
     await update.message.reply_text(
-        help_text,
-        parse_mode=ParseMode.MARKDOWN
+        WELCOME_MESSAGE,
+        parse_mode=ParseMode.MARKDOWN_V2
+    )
+
+
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """פקודת /help"""
+    await update.message.reply_text(
+        HELP_TEXT,
+        parse_mode=ParseMode.MARKDOWN_V2
     )
 
 
 async def analyze_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """פקודת /analyze - ניתוח בלבד"""
     # בדיקה אם יש טקסט אחרי הפקודה
-    if context.args:
-        prompt = " ".join(context.args)
+    prompt = _command_tail(update.message.text)
+    if prompt:
         await analyze_prompt(update, context, prompt)
     else:
         # שמירת מצב - מחכים לפרומפט
-        db = MongoDB()
         session = UserSession(
             user_id=str(update.effective_user.id),
             awaiting_response="analyze"
@@ -110,11 +148,10 @@ async def analyze_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def improve_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """פקודת /improve - שיפור מלא"""
-    if context.args:
-        prompt = " ".join(context.args)
+    prompt = _command_tail(update.message.text)
+    if prompt:
         await improve_prompt(update, context, prompt)
     else:
-        db = MongoDB()
         session = UserSession(
             user_id=str(update.effective_user.id),
             awaiting_response="improve"
@@ -138,16 +175,15 @@ async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    response = "📜 **5 הפרומפטים האחרונים שלך:**\n\n"
-    
-    for i, item in enumerate(history, 1):
-        original = item["original_prompt"][:50] + "..." if len(item["original_prompt"]) > 50 else item["original_prompt"]
-        score_change = f"{item['score_before']}→{item['score_after']}"
-        
-        response += f"{i}. {original}\n"
-        response += f"   📊 ציון: {score_change}\n\n"
+    parts = ["📜 *5 הפרומפטים האחרונים שלך:*\n\n"]
+    parts.extend(
+        f"{i}\\. {escape_md(_trunc(item['original_prompt'], 50))}\n"
+        f"   📊 ציון: {item['score_before']}→{item['score_after']}\n\n"
+        for i, item in enumerate(history, 1)
+    )
+    response = "".join(parts)
     
-    await update.message.reply_text(response, parse_mode=ParseMode.MARKDOWN)
+    await update.message.reply_text(response, parse_mode=ParseMode.MARKDOWN_V2)
 
 
 async def examples_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -160,20 +196,18 @@ async def examples_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    response = "🌟 **דוגמאות לשיפורים מוצלחים:**\n\n"
-    
-    for i, ex in enumerate(examples, 1):
-        response += f"**{i}. קטגוריה: {ex['category']}**\n"
-        response += f"📊 שיפור: {ex['score_before']}→{ex['score_after']} (+{ex['improvement']})\n\n"
-        
-        original = ex["original_prompt"][:100] + "..." if len(ex["original_prompt"]) > 100 else ex["original_prompt"]
-        improved = ex["improved_prompt"][:150] + "..." if len(ex["improved_prompt"]) > 150 else ex["improved_prompt"]
-        
-        response += f"❌ לפני:\n`{original}`\n\n"
-        response += f"✅ אחרי:\n`{improved}`\n\n"
-        response += "---\n\n"
+    parts = ["🌟 *דוגמאות לשיפורים מוצלחים:*\n\n"]
+    parts.extend(
+        f"*{i}\\. קטגוריה: {escape_md(ex['category'])}*\n"
+        f"📊 שיפור: {ex['score_before']}→{ex['score_after']} \\({escape_md(format(ex['improvement'], '+d'))}\\)\n\n"
+        f"❌ לפני:\n`{escape_md_code(_trunc(ex['original_prompt'], 100))}`\n\n"
+        f"✅ אחרי:\n`{escape_md_code(_trunc(ex['improved_prompt'], 150))}`\n\n"
+        "\\-\\-\\-\n\n"
+        for i, ex in enumerate(examples, 1)
+    )
+    response = "".join(parts)
     
-    await update.message.reply_text(response, parse_mode=ParseMode.MARKDOWN)
+    await update.message.reply_text(response, parse_mode=ParseMode.MARKDOWN_V2)
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -181,93 +215,173 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
     text = update.message.text
     
-    # בדיקה אם יש סשן פעיל
-    db = MongoDB()
-    session = await db.get_session(user_id)
+    # בדיקה אם יש סשן שמחכה לשיפור - קריאה ומחיקה בבקשה אחת
+    session = await db.pop_session(user_id, awaiting_response="improve")
     
-    if session and session.awaiting_response == "improve":
+    if session:
         # מצב שיפור
-        await db.clear_session(user_id)
         await improve_prompt(update, context, text)
     else:
         # ברירת מחדל - ניתוח
         await analyze_prompt(update, context, text)
 
 
+class _WaitingMessage:
+    """הודעת "ממתין..." שמוחלפת בתשובה הסופית"""
+    
+    def __init__(self, update: Update, message):
+        self._update = update
+        self.message = message
+        self.deleted = False
+    
+    async def reply(self, text: str, **kwargs):
+        """
+        עריכת הודעת ההמתנה לתשובה הסופית - קריאת API אחת במקום מחיקה + שליחה.
+        אם העריכה נכשלה - מחיקה ושליחת הודעה חדשה.
+        """
+        try:
+            await self.message.edit_text(text, **kwargs)
+            return
+        except Exception as e:
+            logger.debug("Editing waiting message failed, sending a new one: %s", e)
+        try:
+            await self.message.delete()
+            self.deleted = True
+        except Exception:
+            pass  # אם המחיקה נכשלה, נמשיך בכל זאת
+        await self._update.message.reply_text(text, **kwargs)
+
+
+@asynccontextmanager
+async def waiting_message(update: Update, text: str, action: str, error_text: str):
+    """
+    שולח הודעת המתנה, ובשגיאה בתוך הבלוק - רושם ללוג ומציג את error_text
+    (עריכת הודעת ההמתנה אם עדיין קיימת, אחרת הודעה חדשה).
+    """
+    wm = _WaitingMessage(update, await update.message.reply_text(text))
+    try:
+        yield wm
+    except Exception as e:
+        logger.error("%s failed: %s", action, e)
+        if wm.deleted:
+            # ההודעה נמחקה, שולחים הודעה חדשה
+            await update.message.reply_text(error_text)
+            return
+        # ההודעה עדיין קיימת, מעדכנים אותה
+        try:
+            await wm.message.edit_text(error_text)
+        except Exception:
+            # אם גם העריכה נכשלה, שולחים הודעה חדשה
+            await update.message.reply_text(error_text)
+
+
+_READY_LINE_MD = "✅ הפרומפט מוכן לשימוש\\!\n"
+_NOT_READY_LINE_MD = "⚠️ מומלץ לשפר את הפרומפט\n"
+
+
+def format_critique_md(critique: CritiqueResult) -> str:
+    """
+    מעצב ביקורת להודעת טלגרם (MarkdownV2).
+    טקסט שהגיע מהמודל עובר בריחה - כך שטלגרם לא דוחה את ההודעה.
+    """
+    # כל סעיף נבנה כמחרוזת אחת מ-generator, ואז חיבור יחיד בסוף
+    sections = [
+        # ציון כללי
+        f"{score_emoji(critique.overall_score)} *ציון כללי: {critique.overall_score}/10*\n",
+        # סטטוס
+        _READY_LINE_MD if critique.is_ready else _NOT_READY_LINE_MD
+    ]
+    
+    # נקודות חולשה (אם יש)
+    if critique.weaknesses:
+        sections.append("\n".join((
+            "*🔍 נקודות לתיקון:*\n",
+            *(
+                f"{i}\\. {SEVERITY_ICONS.get(w.severity, '⚪')} *{escape_md(w.type)}*\n"
+                f"   {escape_md(w.description)}\n"
+                f"   💡 _{escape_md(w.suggestion)}_\n"
+                for i, w in enumerate(critique.weaknesses, 1)
+            )
+        )))
+    
+    # טיפים מקצועיים לשדרוג
+    if critique.pro_tips:
+        sections.append("\n".join((
+            "*🚀 רעיונות לשדרוג הפרומפט:*\n",
+            *(
+                f"{i}\\. {TECHNIQUE_ICONS.get(tip.technique, '💡')} *{escape_md(tip.title)}* "
+                f"{IMPACT_STARS.get(tip.impact, '⭐')}\n"
+                f"   {escape_md(tip.suggestion)}\n"
+                + (f"   📌 _דוגמה: \"{escape_md(tip.example)}\"_\n" if tip.example else "")
+                for i, tip in enumerate(critique.pro_tips, 1)
+            )
+        )))
+    
+    # פרמטרים חסרים (בסוף, פחות חשוב)
+    if critique.missing_params:
+        sections.append("\n".join((
+            "*❓ שאלות להשלמה:*\n",
+            *(
+                f"{IMPORTANCE_ICONS.get(p.importance, '💭')} {escape_md(p.question)}"
+                for p in critique.missing_params
+            )
+        )))
+    
+    return "\n".join(sections)
+
+
 async def analyze_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE, prompt: str):
     """ביצוע ניתוח פרומפט"""
     user_id = str(update.effective_user.id)
     
-    # הודעת המתנה
-    waiting_msg = await update.message.reply_text("🔍 מנתח את הפרומפט...")
-    waiting_msg_deleted = False
-    
-    try:
+    async with waiting_message(
+        update,
+        "🔍 מנתח את הפרומפט...",
+        action="Analysis",
+        error_text="❌ שגיאה בניתוח. נסה שוב או שלח פרומפט אחר."
+    ) as wm:
         # ניתוח
         analysis = await orchestrator.analyze_prompt(prompt, user_id)
         
         # בניית תגובה
-        response = f"**{analysis['category_description']}**\n\n"
-        response += analysis['formatted_critique']
+        response = _CATEGORY_HEADERS[analysis['category']]
+        response += format_critique_md(analysis['critique'])
         
         # כפתורים - הסרת כפתור "שאל שאלות" כי הוא לא מוסיף ערך
         # השאלות כבר מופיעות בתוך הביקורת, והמשתמש יכול פשוט לשפר את הפרומפט ולשלוח שוב
-        keyboard = [
-            [InlineKeyboardButton("✨ שפר אוטומטית", callback_data=f"improve:{user_id}")]
-        ]
+        keyboard = _improve_keyboard(user_id)
         
-        # לא מוסיפים שאלות מומלצות כפולות - הן כבר מופיעות בתוך formatted_critique
+        # לא מוסיפים שאלות מומלצות כפולות - הן כבר מופיעות בתוך הביקורת המעוצבת
         # כחלק מ-"שאלות להשלמה"
         
         # שמירת הפרומפט בסשן לשימוש עתידי
-        db = MongoDB()
         session = UserSession(
             user_id=user_id,
             current_prompt=prompt,
             current_category=analysis['category'],
-            context={"analysis": analysis}
+            # הביקורת נשמרת כדי ש"שפר אוטומטית" לא ינתח את אותו פרומפט שוב
+            context={"critique": analysis['critique'].model_dump()}
         )
         await db.save_session(session)
         
-        # מחיקת הודעת המתנה רק אחרי שהכל הצליח
-        try:
-            await waiting_msg.delete()
-            waiting_msg_deleted = True
-        except Exception:
-            pass  # אם המחיקה נכשלה, נמשיך בכל זאת
-        
-        await update.message.reply_text(
+        # הודעת ההמתנה מוחלפת רק אחרי שהכל הצליח
+        await wm.reply(
             response,
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            parse_mode=ParseMode.MARKDOWN_V2,
+            reply_markup=keyboard
         )
-        
-    except Exception as e:
-        logger.error(f"Analysis failed: {e}")
-        error_text = "❌ שגיאה בניתוח. נסה שוב או שלח פרומפט אחר."
-        if waiting_msg_deleted:
-            # ההודעה נמחקה, שולחים הודעה חדשה
-            await update.message.reply_text(error_text)
-        else:
-            # ההודעה עדיין קיימת, מעדכנים אותה
-            try:
-                await waiting_msg.edit_text(error_text)
-            except Exception:
-                # אם גם העריכה נכשלה, שולחים הודעה חדשה
-                await update.message.reply_text(error_text)
 
 
 async def improve_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE, prompt: str):
     """ביצוע שיפור מלא"""
     user_id = str(update.effective_user.id)
     
-    # הודעת המתנה
-    waiting_msg = await update.message.reply_text(
-        "⏳ משפר את הפרומפט...\nזה עשוי לקחת כמה שניות."
-    )
-    waiting_msg_deleted = False
-    
-    try:
+    async with waiting_message(
+        update,
+        "⏳ משפר את הפרומפט...\nזה עשוי לקחת כמה שניות.",
+        action="Improvement",
+        error_text="❌ שגיאה בשיפור. נסה שוב או שלח פרומפט אחר."
+    ) as wm:
         # שיפור
         result = await orchestrator.refine_prompt(
             prompt=prompt,
@@ -279,103 +393,92 @@ async def improve_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE, pro
         score_emoji = "🟢" if result.critique.overall_score >= 7 else "🟡"
         delta_emoji = "📈" if result.improvement_delta > 0 else "➡️"
         
-        response = f"✨ **פרומפט משופר!**\n\n"
+        response = "✨ *פרומפט משופר\\!*\n\n"
         response += f"📊 ציון: {result.critique.overall_score}/10 {score_emoji}\n"
-        response += f"{delta_emoji} שיפור: +{result.improvement_delta} נקודות\n"
+        response += f"{delta_emoji} שיפור: {escape_md(format(result.improvement_delta, '+d'))} נקודות\n"
         response += f"🔄 איטרציות: {result.iterations_used}\n\n"
-        response += f"**📝 הפרומפט המשופר:**\n```\n{result.improved_prompt}\n```\n\n"
-        response += f"**💡 הסבר:**\n{result.explanation}"
+        response += f"*📝 הפרומפט המשופר:*\n```\n{escape_md_code(result.improved_prompt)}\n```\n\n"
+        response += f"*💡 הסבר:*\n{escape_md(result.explanation)}"
         
         # כפתורי משוב
-        keyboard = [
-            [
-                InlineKeyboardButton("⭐1", callback_data=f"rate:1:{user_id}"),
-                InlineKeyboardButton("⭐2", callback_data=f"rate:2:{user_id}"),
-                InlineKeyboardButton("⭐3", callback_data=f"rate:3:{user_id}"),
-                InlineKeyboardButton("⭐4", callback_data=f"rate:4:{user_id}"),
-                InlineKeyboardButton("⭐5", callback_data=f"rate:5:{user_id}"),
-            ],
-            [InlineKeyboardButton("📋 העתק", callback_data=f"copy:{user_id}")]
-        ]
-        
-        # מחיקת הודעת המתנה רק אחרי שהכל הצליח
-        try:
-            await waiting_msg.delete()
-            waiting_msg_deleted = True
-        except Exception:
-            pass  # אם המחיקה נכשלה, נמשיך בכל זאת
+        keyboard = _rating_keyboard(user_id)
         
-        await update.message.reply_text(
+        # הודעת ההמתנה מוחלפת רק אחרי שהכל הצליח
+        await wm.reply(
             response,
-            parse_mode=ParseMode.MARKDOWN,
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            parse_mode=ParseMode.MARKDOWN_V2,
+            reply_markup=keyboard
         )
-        
-    except Exception as e:
-        logger.error(f"Improvement failed: {e}")
-        error_text = "❌ שגיאה בשיפור. נסה שוב או שלח פרומפט אחר."
-        if waiting_msg_deleted:
-            # ההודעה נמחקה, שולחים הודעה חדשה
-            await update.message.reply_text(error_text)
-        else:
-            # ההודעה עדיין קיימת, מעדכנים אותה
-            try:
-                await waiting_msg.edit_text(error_text)
-            except Exception:
-                # אם גם העריכה נכשלה, שולחים הודעה חדשה
-                await update.message.reply_text(error_text)
 
 
-async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """טיפול בלחיצות על כפתורים"""
-    query = update.callback_query
-    await query.answer()
-    
-    data = query.data.split(":")
-    action = data[0]
+async def _cb_improve(query, args: str):
+    """כפתור "שפר אוטומטית" - args הוא מזהה המשתמש"""
+    user_id = args
+    session = await db.get_session(user_id)
     
-    if action == "improve":
-        user_id = data[1]
-        db = MongoDB()
-        session = await db.get_session(user_id)
+    if session and session.current_prompt:
+        # יצירת הודעה "מזויפת" לשיפור
+        await query.message.reply_text(
+            "⏳ משפר את הפרומפט...\nזה עשוי לקחת כמה שניות."
+        )
         
-        if session and session.current_prompt:
-            # יצירת הודעה "מזויפת" לשיפור
-            await query.message.reply_text(
-                "⏳ משפר את הפרומפט...\nזה עשוי לקחת כמה שניות."
-            )
-            
-            result = await orchestrator.refine_prompt(
-                prompt=session.current_prompt,
-                user_id=user_id,
-                use_iterations=True
-            )
-            
-            response = f"✨ **פרומפט משופר!**\n\n"
-            response += f"**📝 הפרומפט המשופר:**\n```\n{result.improved_prompt}\n```\n\n"
-            response += f"**💡 הסבר:**\n{result.explanation}"
-            
-            await query.message.reply_text(
-                response,
-                parse_mode=ParseMode.MARKDOWN
+        cached_critique = session.context.get("critique")
+        result = await orchestrator.refine_prompt(
+            prompt=session.current_prompt,
+            user_id=user_id,
+            use_iterations=True,
+            category=session.current_category,
+            initial_critique=(
+                CritiqueResult.model_validate(cached_critique) if cached_critique else None
             )
-    
-    elif action == "rate":
-        rating = int(data[1])
-        user_id = data[2]
+        )
+        
+        response = "✨ *פרומפט משופר\\!*\n\n"
+        response += f"*📝 הפרומפט המשופר:*\n```\n{escape_md_code(result.improved_prompt)}\n```\n\n"
+        response += f"*💡 הסבר:*\n{escape_md(result.explanation)}"
         
-        # TODO: שמירת הדירוג
         await query.message.reply_text(
-            f"🙏 תודה על הדירוג! ({rating}/5 ⭐)"
+            response,
+            parse_mode=ParseMode.MARKDOWN_V2
         )
+
+
+async def _cb_rate(query, args: str):
+    """כפתורי דירוג - args הוא "<rating>:<user_id>\""""
+    rating, _, user_id = args.partition(":")
     
-    elif action == "questions":
-        # כפתור זה הוסר - השאלות כבר מופיעות בביקורת
-        # אם מישהו עדיין לחץ עליו (backwards compatibility), נפנה אותו להסתכל בביקורת
-        await query.message.reply_text(
-            "📝 השאלות להשלמה מופיעות כבר בהודעת הניתוח למעלה.\n"
-            "שפר את הפרומפט שלך ושלח אותו שוב לניתוח, או לחץ על 'שפר אוטומטית'."
-        )
+    # TODO: שמירת הדירוג
+    await query.message.reply_text(
+        f"🙏 תודה על הדירוג! ({int(rating)}/5 ⭐)"
+    )
+
+
+async def _cb_questions(query, args: str):
+    """כפתור זה הוסר - השאלות כבר מופיעות בביקורת"""
+    # אם מישהו עדיין לחץ עליו (backwards compatibility), נפנה אותו להסתכל בביקורת
+    await query.message.reply_text(
+        "📝 השאלות להשלמה מופיעות כבר בהודעת הניתוח למעלה.\n"
+        "שפר את הפרומפט שלך ושלח אותו שוב לניתוח, או לחץ על 'שפר אוטומטית'."
+    )
+
+
+# פעולה (החלק שלפני ה-":" הראשון ב-callback_data) -> handler
+_CALLBACK_HANDLERS = {
+    "improve": _cb_improve,
+    "rate": _cb_rate,
+    "questions": _cb_questions,
+}
+
+
+async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """טיפול בלחיצות על כפתורים"""
+    query = update.callback_query
+    await query.answer()
+    
+    action, _, args = query.data.partition(":")
+    handler = _CALLBACK_HANDLERS.get(action)
+    if handler:
+        await handler(query, args)
 
 
 # ========== Bot Setup ==========
@@ -383,26 +486,34 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 def create_bot() -> Application:
     """יצירת הבוט"""
     logger.info("Creating bot application...")
-    print("Creating bot application...")  # Debug print
-    application = Application.builder().token(config.TELEGRAM_BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(config.TELEGRAM_BOT_TOKEN)
+        # חיבורי HTTP/2 משותפים ל-api.telegram.org
+        .request(HTTPXRequest(http_version="2", connection_pool_size=100, pool_timeout=1.0))
+        .get_updates_request(HTTPXRequest(http_version="2"))
+        .build()
+    )
 
+    # block=False - קריאת LLM ארוכה של משתמש אחד לא עוצרת את העדכונים של אחרים
     # פקודות
-    application.add_handler(CommandHandler("start", start_command))
+    application.add_handler(CommandHandler("start", start_command, block=False))
     logger.info("Added start command handler")
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("analyze", analyze_command))
-    application.add_handler(CommandHandler("improve", improve_command))
-    application.add_handler(CommandHandler("history", history_command))
-    application.add_handler(CommandHandler("examples", examples_command))
+    application.add_handler(CommandHandler("help", help_command, block=False))
+    application.add_handler(CommandHandler("analyze", analyze_command, block=False))
+    application.add_handler(CommandHandler("improve", improve_command, block=False))
+    application.add_handler(CommandHandler("history", history_command, block=False))
+    application.add_handler(CommandHandler("examples", examples_command, block=False))
     
     # הודעות טקסט
     application.add_handler(MessageHandler(
         filters.TEXT & ~filters.COMMAND,
-        handle_message
+        handle_message,
+        block=False
     ))
     
     # Callbacks
-    application.add_handler(CallbackQueryHandler(handle_callback))
+    application.add_handler(CallbackQueryHandler(handle_callback, block=False))
     
     return application
 
@@ -413,11 +524,4 @@ async def setup_webhook(application: Application, webhook_url: str):
         url=f"{webhook_url}/webhook",
         allowed_updates=["message", "callback_query"]
     )
-    logger.info(f"Webhook set to {webhook_url}/webhook")
-
-
-def run_polling():
-    """הרצה במצב polling (לפיתוח)"""
-    application = create_bot()
-    logger.info("Starting bot in polling mode...")
-    application.run_polling(allowed_updates=["message", "callback_query"])
+    logger.info("Webhook set to %s/webhook", webhook_url)
@@ -4,9 +4,10 @@ Prompt Enhancer - Configuration
 """
 import os
 from dataclasses import dataclass
-from typing import Optional
+from typing import Optional, Tuple
 
-@dataclass
+# frozen + slots: ההגדרות נקראות פעם אחת בטעינה ולא משתנות בזמן ריצה
+@dataclass(frozen=True, slots=True)
 class Config:
     # Telegram
     TELEGRAM_BOT_TOKEN: str = os.getenv("TELEGRAM_BOT_TOKEN", "")
@@ -15,12 +16,20 @@ class Config:
     MONGODB_URI: str = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
     MONGODB_DB_NAME: str = os.getenv("MONGODB_DB_NAME", "prompt_enhancer")
     
+    # Redis (אופציונלי) - מטמון סשנים מעל MongoDB
+    REDIS_URL: Optional[str] = os.getenv("REDIS_URL")  # redis://localhost:6379/0
+    
     # AI Models
     GEMINI_API_KEY: str = os.getenv("GEMINI_API_KEY", "")
     ANTHROPIC_API_KEY: str = os.getenv("ANTHROPIC_API_KEY", "")
     OPENAI_API_KEY: str = os.getenv("OPENAI_API_KEY", "")
     
     # Model Selection
+    # שרשרת מודלי Gemini לפי סדר: ראשי ואחריו גיבויים (מופרדים בפסיק)
+    GEMINI_MODELS: Tuple[str, ...] = tuple(
+        m.strip() for m in os.getenv("GEMINI_MODELS", "gemini-2.5-flash,gemini-2.5-flash-lite").split(",")
+        if m.strip()
+    )
     PRIMARY_MODEL: str = os.getenv("PRIMARY_MODEL", "gemini")  # gemini, claude, openai
     CRITIC_MODEL: str = os.getenv("CRITIC_MODEL", "gemini-flash")  # מודל זול לביקורת
     REFINER_MODEL: str = os.getenv("REFINER_MODEL", "gemini-pro")  # מודל איכותי לשיפור
@@ -0,0 +1,71 @@
+"""
+Telegram MarkdownV2 helpers
+בריחת תווים ל-MarkdownV2 של טלגרם - טבלת תרגום אחת, בלי regex לכל הודעה
+"""
+import re
+
+# התווים המיוחדים של MarkdownV2 (לפי תיעוד Bot API)
+_SPECIAL_CHARS = "\\_*[]()~`>#+-=|{}.!"
+
+_ESCAPE_TABLE = str.maketrans({c: "\\" + c for c in _SPECIAL_CHARS})
+# בתוך `code` / ```pre``` בורחים רק מ-` ומ-\
+_CODE_ESCAPE_TABLE = str.maketrans({"`": "\\`", "\\": "\\\\"})
+
+# סימון בטקסטים הקבועים: **מודגש** ו-`קוד`
+_STATIC_MARKUP_RE = re.compile(r"\*\*(.+?)\*\*|`(.+?)`")
+
+
+def escape_md(text) -> str:
+    """בריחה מלאה לטקסט דינמי בתוך הודעת MarkdownV2"""
+    return str(text).translate(_ESCAPE_TABLE)
+
+
+def escape_md_code(text) -> str:
+    """בריחה לטקסט בתוך בלוק קוד"""
+    return str(text).translate(_CODE_ESCAPE_TABLE)
+
+
+def render_md(text: str) -> str:
+    """
+    ממיר טקסט קבוע עם **הדגשות** ו-`קוד` ל-MarkdownV2 תקין.
+    מיועד לחישוב חד-פעמי בטעינת המודול.
+    """
+    parts = []
+    pos = 0
+    for match in _STATIC_MARKUP_RE.finditer(text):
+        parts.append(escape_md(text[pos:match.start()]))
+        bold, code = match.groups()
+        if bold is not None:
+            parts.append(f"*{escape_md(bold)}*")
+        else:
+            parts.append(f"`{escape_md_code(code)}`")
+        pos = match.end()
+    parts.append(escape_md(text[pos:]))
+    return "".join(parts)
+
+
+def validate_md(text: str) -> str:
+    """
+    בדיקה offline של MarkdownV2: אין תו מיוחד בלי בריחה וכל סימון נסגר.
+    מחזיר את הטקסט כמו שהוא, וזורק ValueError אם טלגרם היה דוחה אותו.
+    """
+    open_marks = set()
+    in_code = False
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char == "\\":
+            i += 2
+            continue
+        if in_code:
+            in_code = char != "`"
+        elif char == "`":
+            in_code = True
+        elif char in "*_~":
+            open_marks ^= {char}
+        elif char in _SPECIAL_CHARS:
+            raise ValueError(f"unescaped {char!r} at position {i}")
+        i += 1
+    if in_code or open_marks:
+        raise ValueError(f"unclosed markup: {sorted(open_marks) or ['`']}")
+    return text
@@ -3,7 +3,7 @@ Core Models - Pydantic schemas
 """
 from enum import Enum
 from typing import List, Optional, Dict, Any
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from datetime import datetime
 
 
@@ -20,6 +20,8 @@ class PromptCategory(str, Enum):
 
 class Weakness(BaseModel):
     """נקודת חולשה בפרומפט"""
+    model_config = ConfigDict(frozen=True)
+    
     type: str = Field(..., description="סוג החולשה: ambiguity, context, assumption, format, specificity")
     description: str = Field(..., description="תיאור הבעיה בעברית")
     suggestion: str = Field(..., description="הצעה לתיקון")
@@ -28,6 +30,8 @@ class Weakness(BaseModel):
 
 class MissingParameter(BaseModel):
     """פרמטר חסר"""
+    model_config = ConfigDict(frozen=True)
+    
     name: str
     question: str = Field(..., description="שאלה למשתמש בעברית")
     importance: str = Field(default="recommended", description="required או recommended")
@@ -35,6 +39,8 @@ class MissingParameter(BaseModel):
 
 class ProTip(BaseModel):
     """טיפ מקצועי לשדרוג הפרומפט"""
+    model_config = ConfigDict(frozen=True)
+    
     technique: str = Field(..., description="שם הטכניקה: role_playing, chain_of_thought, few_shot, constraints, structure, creativity")
     title: str = Field(..., description="כותרת קצרה בעברית")
     suggestion: str = Field(..., description="ההצעה המלאה בעברית")
@@ -13,7 +13,7 @@ from core.models import (
     PromptHistory, MissingParameter
 )
 from agents import ShadowCritic, CategoryRouter, ParameterValidator, PromptRefiner
-from database.mongodb import MongoDB
+from database.mongodb import db
 
 logger = logging.getLogger(__name__)
 
@@ -35,7 +35,11 @@ class PromptEnhancerOrchestrator:
         self.param_validator = ParameterValidator()
         self.shadow_critic = ShadowCritic()
         self.refiner = PromptRefiner()
-        self.db = MongoDB()
+        self.db = db
+        # תיאורי הקטגוריות קבועים - מחושבים פעם אחת
+        self._category_descs = {
+            c: self.category_router.get_category_description(c) for c in PromptCategory
+        }
     
     async def analyze_prompt(
         self, 
@@ -48,41 +52,58 @@ class PromptEnhancerOrchestrator:
         
         מתאים ל"מצב מאמן" - לתת למשתמש לראות מה צריך לשפר.
         """
-        logger.info(f"Analyzing prompt for user {user_id}")
-        
-        # זיהוי קטגוריה
-        category, confidence = await self.category_router.detect_category(prompt)
-        logger.info(f"Category: {category.value} (confidence: {confidence:.2f})")
+        logger.info("Analyzing prompt for user %s", user_id)
         
-        # ביקורת
-        critique = await self.shadow_critic.critique(prompt, category)
-        
-        # בדיקת פרמטרים חסרים
-        missing_params = await self.param_validator.validate(prompt, category)
-        
-        # הוספת פרמטרים חסרים לביקורת
-        critique.missing_params = missing_params
+        category, confidence, critique = await self._analyze_core(prompt)
         
         # שאלות למשתמש
-        questions = self.param_validator.get_questions_for_missing(missing_params)
+        questions = self.param_validator.get_questions_for_missing(critique.missing_params)
         
         return {
             "original_prompt": prompt,
             "category": category,
-            "category_description": self.category_router.get_category_description(category),
+            "category_description": self._category_descs[category],
             "confidence": confidence,
             "critique": critique,
             "questions": questions,
             "formatted_critique": self.shadow_critic.format_critique_hebrew(critique)
         }
     
+    async def _analyze_core(self, prompt: str, validate: bool = True):
+        """
+        זיהוי קטגוריה + ביקורת (+ בדיקת פרמטרים חסרים, אם validate).
+        מחזיר (קטגוריה, ביטחון, ביקורת).
+        """
+        # הביקורת צריכה את הקטגוריה - קודם זיהוי, ואז ביקורת ובדיקת פרמטרים במקביל
+        category, confidence = await self._detect(prompt)
+        if not validate:
+            critique = await self.shadow_critic.critique(prompt, category)
+            return category, confidence, critique
+        
+        critique, missing_params = await asyncio.gather(
+            self.shadow_critic.critique(prompt, category),
+            self.param_validator.validate(prompt, category)
+        )
+        
+        # הוספת פרמטרים חסרים לביקורת
+        critique.missing_params = missing_params
+        return category, confidence, critique
+    
+    async def _detect(self, prompt: str):
+        """זיהוי קטגוריה (עם לוג)"""
+        category, confidence = await self.category_router.detect_category(prompt)
+        logger.info("Category: %s (confidence: %.2f)", category.value, confidence)
+        return category, confidence
+    
     async def refine_prompt(
         self,
         prompt: str,
         user_id: str,
         user_answers: Optional[Dict[str, str]] = None,
         use_iterations: bool = True,
-        max_iterations: int = None
+        max_iterations: int = None,
+        category: Optional[PromptCategory] = None,
+        initial_critique: Optional[CritiqueResult] = None
     ) -> RefinementResult:
         """
         שלב שני: שיפור מלא של הפרומפט.
@@ -93,30 +114,33 @@ class PromptEnhancerOrchestrator:
             user_answers: תשובות לשאלות שנשאלו (אופציונלי)
             use_iterations: האם להשתמש בשיפור איטרטיבי
             max_iterations: מקסימום איטרציות (ברירת מחדל מ-config)
+            category: קטגוריה מניתוח קודם (אופציונלי - יחד עם initial_critique)
+            initial_critique: ביקורת מניתוח קודם - אם סופקו שניהם, הניתוח הראשוני מדולג
         """
-        logger.info(f"Refining prompt for user {user_id}")
+        logger.info("Refining prompt for user %s", user_id)
         
         if max_iterations is None:
             max_iterations = config.MAX_ITERATIONS
         
-        # שלב 1: ניתוח ראשוני
-        analysis = await self.analyze_prompt(prompt, user_id)
-        category = analysis["category"]
-        initial_critique = analysis["critique"]
+        iterative = use_iterations and max_iterations > 1
+        
+        # שלב 1: ניתוח ראשוני - בשיפור איטרטיבי אין שאלות למשתמש, אז בלי בדיקת פרמטרים
+        if category is None or initial_critique is None:
+            category, _, initial_critique = await self._analyze_core(prompt, validate=not iterative)
         
         # ציון התחלתי
         score_before = initial_critique.overall_score
         
         # שלב 2: שיפור
-        if use_iterations and max_iterations > 1:
-            # שיפור איטרטיבי
-            improved_prompt, iterations_used, critiques = await self.refiner.refine_iterative(
+        if iterative:
+            # שיפור איטרטיבי - מתחיל מהביקורת שכבר יש, בלי לבקר שוב את המקור
+            improved_prompt, iterations_used, _, final_critique = await self.refiner.refine_iterative(
                 original_prompt=prompt,
                 category=category,
                 max_iterations=max_iterations,
-                target_score=8
+                target_score=8,
+                initial_critique=initial_critique
             )
-            final_critique = critiques[-1] if critiques else initial_critique
         else:
             # שיפור חד-פעמי
             improved_prompt = await self.refiner.refine(
@@ -188,22 +212,24 @@ class PromptEnhancerOrchestrator:
     ):
         """שמירה למסד נתונים"""
         try:
-            history = PromptHistory(
+            # הערכים כבר מאומתים (מודלים וטיפוסים שלנו) - model_construct בלי ולידציה חוזרת,
+            # והחולשות מומרות ב-model_dump אחד של pydantic-core במקום קריאה לכל פריט
+            history = PromptHistory.model_construct(
                 user_id=user_id,
                 original_prompt=original,
                 improved_prompt=improved,
                 category=category,
-                weaknesses=[w.model_dump() for w in critique.weaknesses],
+                weaknesses=critique.model_dump(include={"weaknesses"})["weaknesses"],
                 score_before=score_before,
                 score_after=score_after,
                 iterations=iterations
             )
             
             await self.db.save_prompt_history(history)
-            logger.info(f"Saved prompt history for user {user_id}")
+            logger.info("Saved prompt history for user %s", user_id)
             
         except Exception as e:
-            logger.error(f"Failed to save to DB: {e}")
+            logger.error("Failed to save to DB: %s", e)
             # לא נכשל את כל הזרימה בגלל שמירה
     
     async def get_user_history(
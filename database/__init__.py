@@ -1,4 +1,4 @@
 # Database package
-from .mongodb import MongoDB
+from .mongodb import MongoDB, db
 
-__all__ = ['MongoDB']
+__all__ = ['MongoDB', 'db']
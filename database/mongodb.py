@@ -1,31 +1,203 @@
 """
 MongoDB Connection and Operations
 """
+import asyncio
 import logging
+import time
 from typing import Optional, List, Dict, Any
-from datetime import datetime
-from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo import DESCENDING
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import AsyncMongoClient, DESCENDING, IndexModel, InsertOne, ReadPreference, UpdateMany, UpdateOne, WriteConcern
+from pymongo.errors import BulkWriteError, OperationFailure
 
 from config import config
 from core.models import PromptHistory, PromptCategory, UserSession
 
 logger = logging.getLogger(__name__)
 
+# כתיבת היסטוריה באצוות: עד כמה מסמכים בכתיבה אחת, וכמה זמן לחכות למסמכים נוספים (שניות)
+_HISTORY_BATCH_SIZE = 100
+_HISTORY_FLUSH_INTERVAL = 0.5
+# כתיבה שנכשלה: כמה ניסיונות בסך הכל, והמתנה לפני הניסיון הבא (שניות, מוכפלת בכל פעם)
+_HISTORY_WRITE_ATTEMPTS = 4
+_HISTORY_RETRY_DELAY = 0.5
+# קוד duplicate key - המסמך כבר נכתב בניסיון קודם
+_DUPLICATE_KEY_ERROR = 11000
+
+# כמה זמן סטטיסטיקות מחושבות נשארות בזיכרון (שניות)
+_STATS_TTL = 60
+
+# דוגמאות קהילתיות: כמה זמן תוצאה נשמרת בזיכרון (שניות), ולכמה צירופי פרמטרים
+_TOP_IMPROVEMENTS_TTL = 90
+_TOP_IMPROVEMENTS_CACHE_SIZE = 64
+
+# כמה זמן סשן נשמר ב-Redis (שניות) - רק כש-REDIS_URL מוגדר
+_SESSION_TTL = 300
+
+# מסמך הסיכום היחיד ב-stats_summary: מונים מצטברים שמתעדכנים בכל כתיבת היסטוריה
+_STATS_SUMMARY_ID = "global"
+# הבנייה סופרת רק מסמכים שנוצרו לפני עכשיו פחות המרווח (ה-cutoff), והכותב את כל השאר.
+# המרווח ארוך בהרבה ממה שמסמך מחכה בתור ובניסיונות חוזרים - כל מה שלפני ה-cutoff כבר נכתב
+_STATS_SUMMARY_CUTOFF_MARGIN = timedelta(minutes=5)
+
+
+# קוד מספרי קבוע לכל קטגוריה - כך היא נשמרת במסמכי ההיסטוריה ובאינדקסים.
+# לא לשנות קודים קיימים, רק להוסיף חדשים
+_CATEGORY_CODES: Dict[PromptCategory, int] = {
+    PromptCategory.CODE: 1,
+    PromptCategory.CREATIVE: 2,
+    PromptCategory.IMAGE_GENERATION: 3,
+    PromptCategory.ANALYSIS: 4,
+    PromptCategory.BUSINESS: 5,
+    PromptCategory.EDUCATION: 6,
+    PromptCategory.GENERAL: 7,
+}
+_CATEGORIES_BY_CODE: Dict[int, PromptCategory] = {code: c for c, code in _CATEGORY_CODES.items()}
+
+# קוד -> שם בצד השרת (מערך לפי אינדקס הקוד); מסמך ישן עם שם במקום קוד עובר כמו שהוא
+_CATEGORY_NAME_EXPR = {"$cond": [
+    {"$isNumber": "$category"},
+    {"$arrayElemAt": [
+        [c.value if c else None
+         for c in map(_CATEGORIES_BY_CODE.get, range(max(_CATEGORIES_BY_CODE) + 1))],
+        "$category"
+    ]},
+    "$category"
+]}
+# _id כמחרוזת כבר מהשרת - בלי לולאת str() בפייתון
+_ID_STRING_EXPR = {"$toString": "$_id"}
+
+
+# שדות טקסט גדולים נשמרים ב-prompt_texts (אותו _id) - prompt_history נשאר קטן לסינון ולמיון
+_TEXT_FIELDS = ("original_prompt", "improved_prompt", "weaknesses")
+
+# צירוף הטקסטים - רץ אחרי $limit, כך שה-join הוא על ≤limit מסמכים
+_TEXTS_LOOKUP = {"$lookup": {
+    "from": "prompt_texts",
+    "localField": "_id",
+    "foreignField": "_id",
+    "as": "texts"
+}}
+
+
+def _text_field(name: str) -> Dict[str, Any]:
+    """שדה טקסט מ-prompt_texts, ובמסמך ישן (לפני הפיצול) - מהמסמך עצמו"""
+    return {"$ifNull": [{"$first": f"$texts.{name}"}, f"${name}"]}
+
+
+# צורות השאילתות הקבועות - נבנות פעם אחת בטעינה ולא בכל קריאה
+_HISTORY_SORT = {"$sort": {"created_at": -1}}
+_HISTORY_PROJECT = {"$project": {
+    "_id": _ID_STRING_EXPR,
+    "original_prompt": _text_field("original_prompt"),
+    "improved_prompt": _text_field("improved_prompt"),
+    "category": _CATEGORY_NAME_EXPR,
+    "score_before": 1,
+    "score_after": 1,
+    "created_at": 1
+}}
+
+_EXAMPLES_SORT = {"$sort": {"improvement": -1, "score_after": -1}}
+_EXAMPLES_PROJECT = {"$project": {
+    "_id": _ID_STRING_EXPR,
+    "original_prompt": _text_field("original_prompt"),
+    "improved_prompt": _text_field("improved_prompt"),
+    "category": _CATEGORY_NAME_EXPR,
+    "score_before": 1,
+    "score_after": 1,
+    "improvement": 1
+}}
+
+# בניית מסמך הסיכום: סכומים וחלוקה לקטגוריות במעבר אחד ($facet), אחרי $match על ה-cutoff
+_STATS_SUMMARY_FACET = {"$facet": {
+    "totals": [{"$group": {
+        "_id": None,
+        "count": {"$sum": 1},
+        "sum_before": {"$sum": "$score_before"},
+        "sum_after": {"$sum": "$score_after"}
+    }}],
+    "by_category": [{"$group": {"_id": "$category", "count": {"$sum": 1}}}]
+}}
+
+# מיגרציות חד-פעמיות של מסמכים ישנים ב-prompt_history: שם -> כתיבות.
+# כל מיגרציה רצה עד שהיא מסומנת כהושלמה ב-migrations, ואז לא נוגעים בה יותר
+_HISTORY_MIGRATIONS: Dict[str, list] = {
+    # שם קטגוריה -> קוד מספרי (על אינדקס category)
+    "history_category_codes": [
+        UpdateMany({"category": category.value}, {"$set": {"category": code}})
+        for category, code in _CATEGORY_CODES.items()
+    ],
+    # שדה improvement למסמכים שנשמרו לפני שהיה קיים (סריקה מלאה - אין אינדקס ל-$exists: false)
+    "history_improvement": [UpdateMany(
+        {"improvement": {"$exists": False}},
+        [{"$set": {"improvement": {"$subtract": ["$score_after", "$score_before"]}}}]
+    )],
+}
+
+
+def _category_name(code) -> str:
+    """קוד שמור -> שם הקטגוריה (מסמך ישן עוד עשוי להכיל את השם עצמו)"""
+    category = _CATEGORIES_BY_CODE.get(code)
+    return category.value if category else code
+
+
+def _session_key(user_id: str) -> str:
+    """מפתח הסשן ב-Redis"""
+    return f"session:{user_id}"
+
+
+def _summary_increments(docs: List[Dict[str, Any]]) -> Dict[str, int]:
+    """ערכי $inc למסמך הסיכום עבור אצוות מסמכי היסטוריה"""
+    inc = {"count": len(docs), "sum_before": 0, "sum_after": 0}
+    for doc in docs:
+        inc["sum_before"] += doc["score_before"]
+        inc["sum_after"] += doc["score_after"]
+        key = f"by_category.{_category_name(doc['category'])}"
+        inc[key] = inc.get(key, 0) + 1
+    return inc
+
 
 class MongoDB:
     """
-    חיבור ל-MongoDB עם Motor (async driver).
+    חיבור ל-MongoDB עם ה-driver האסינכרוני של PyMongo (asyncio נייטיב, בלי thread pool).
     """
     
-    _client: Optional[AsyncIOMotorClient] = None
+    _client: Optional[AsyncMongoClient] = None
     _db = None
+    _redis = None  # מטמון סשנים אופציונלי (write-through)
     
     def __init__(self):
         if MongoDB._client is None:
-            MongoDB._client = AsyncIOMotorClient(config.MONGODB_URI)
+            MongoDB._client = AsyncMongoClient(
+                config.MONGODB_URI,
+                # דחיסת תעבורה (נבחרת מול השרת); zstd דרך pymongo[zstd], zlib מובנה
+                compressors="zstd,zlib",
+                zlibCompressionLevel=3,
+                maxPoolSize=50,
+                minPoolSize=10,
+                maxIdleTimeMS=60_000,
+                # כשל מהיר כשהשרת לא זמין, במקום 30 שניות של ברירת המחדל
+                serverSelectionTimeoutMS=3_000,
+                retryWrites=True
+            )
             MongoDB._db = MongoDB._client[config.MONGODB_DB_NAME]
             logger.info(f"Connected to MongoDB: {config.MONGODB_DB_NAME}")
+            if config.REDIS_URL:
+                # ייבוא עצל - redis נדרש רק כשמטמון הסשנים מופעל
+                import redis.asyncio as redis
+                MongoDB._redis = redis.from_url(config.REDIS_URL)
+                logger.info("Session cache: Redis")
+        self._history_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._history_queue: Optional[asyncio.Queue] = None
+        self._history_writer: Optional[asyncio.Task] = None
+        self._stats_cache: Optional[tuple] = None  # (timestamp, stats)
+        self._stats_lock = asyncio.Lock()
+        # ה-cutoff של מסמך הסיכום (ידוע אחרי שהוא קיים), ומסמכים שנכתבו לפני כן ועוד לא נספרו
+        self._summary_cutoff: Optional[datetime] = None
+        self._unsummarized: List[Dict[str, Any]] = []
+        # (category, min_improvement, limit) -> (timestamp, examples) / משימה שרצה כרגע
+        self._top_cache: Dict[tuple, tuple] = {}
+        self._top_inflight: Dict[tuple, asyncio.Task] = {}
     
     @property
     def db(self):
@@ -35,24 +207,175 @@ class MongoDB:
     def prompts_collection(self):
         return self.db["prompt_history"]
     
+    @property
+    def texts_collection(self):
+        return self.db["prompt_texts"]
+    
     @property
     def sessions_collection(self):
         return self.db["user_sessions"]
     
     @property
     def feedback_collection(self):
-        return self.db["user_feedback"]
+        # לוג אנליטיקה בלבד - w=0 (בלי המתנה לאישור מהשרת), אובדן רשומה בודדת בקריסה זה בסדר
+        return self.db.get_collection("user_feedback", write_concern=WriteConcern(w=0))
+    
+    @property
+    def stats_collection(self):
+        return self.db["stats_summary"]
+    
+    @property
+    def migrations_collection(self):
+        return self.db["migrations"]
+    
+    @property
+    def examples_collection(self):
+        # דוגמאות קהילתיות לא חייבות להיות עדכניות לשנייה - קריאה מ-secondary כשיש replica set
+        return self.db.get_collection(
+            "prompt_history",
+            read_preference=ReadPreference.SECONDARY_PREFERRED
+        )
     
     # ========== Prompt History ==========
     
     async def save_prompt_history(self, history: PromptHistory) -> str:
-        """שמירת היסטוריית פרומפט"""
-        doc = history.model_dump()
-        doc["category"] = doc["category"].value  # המרה ל-string
+        """
+        שמירת היסטוריית פרומפט.
+        המסמך נכנס לתור ונכתב ברקע ב-bulk_write - ה-id נוצר מראש בצד הלקוח.
+        """
+        # dump אחד שממשיך להשתנות במקום; שדות ריקים (feedback/rating) לא נשמרים עד שיש משוב
+        doc = history.model_dump(exclude_none=True)
+        doc["category"] = _CATEGORY_CODES[doc["category"]]  # int קצר במקום המחרוזת
+        # שדה מחושב מראש - כדי שסינון ומיון לפי שיפור ירוצו על אינדקס
+        doc["improvement"] = doc["score_after"] - doc["score_before"]
+        doc["_id"] = ObjectId()
+        
+        self._start_history_writer()
+        self._history_queue.put_nowait(doc)
+        logger.debug(f"Queued prompt history: {doc['_id']}")
+        return str(doc["_id"])
+    
+    def _start_history_writer(self):
+        """מפעיל את משימת הכתיבה ברקע (פעם אחת לכל event loop)"""
+        loop = asyncio.get_running_loop()
+        if self._history_loop is loop and self._history_writer and not self._history_writer.done():
+            return
+        # התור והמשימה חייבים לחיות על ה-loop הנוכחי
+        self._history_loop = loop
+        self._history_queue = asyncio.Queue()
+        self._history_writer = loop.create_task(self._write_history())
+    
+    async def _write_history(self):
+        """אוסף מסמכים עד _HISTORY_BATCH_SIZE או _HISTORY_FLUSH_INTERVAL וכותב אותם יחד"""
+        loop = asyncio.get_running_loop()
+        queue = self._history_queue
+        while True:
+            docs = [await queue.get()]
+            deadline = loop.time() + _HISTORY_FLUSH_INTERVAL
+            while len(docs) < _HISTORY_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    docs.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._save_history_batch(docs)
+            except Exception as e:
+                logger.error(f"Failed to save {len(docs)} prompt history documents: {e}")
+            finally:
+                for _ in docs:
+                    queue.task_done()
+    
+    async def _save_history_batch(self, docs: List[Dict[str, Any]]):
+        """
+        כתיבת אצווה אחת (טקסטים ואז היסטוריה) ועדכון מסמך הסיכום במה שנכתב בפועל.
+        המסמכים שבתור לא משתנים - כל אוסף מקבל עותק משלו, כך שניסיון חוזר רואה את המסמך המלא.
+        """
+        # הטקסטים קודם - מסמך היסטוריה לא יפנה לטקסטים שלא נכתבו
+        texts = [{"_id": doc["_id"], **{field: doc[field] for field in _TEXT_FIELDS}} for doc in docs]
+        lost_texts = await self._insert_with_retry(self.texts_collection, texts)
+        if lost_texts:
+            logger.error(f"Lost prompt history documents (texts): {[str(doc['_id']) for doc in lost_texts]}")
+        lost_text_ids = {doc["_id"] for doc in lost_texts}
+        
+        entries = [
+            {key: value for key, value in doc.items() if key not in _TEXT_FIELDS}
+            for doc in docs if doc["_id"] not in lost_text_ids
+        ]
+        lost = await self._insert_with_retry(self.prompts_collection, entries)
+        lost_ids = {doc["_id"] for doc in lost}
+        if lost_ids:
+            logger.error(f"Lost prompt history documents: {[str(i) for i in lost_ids]}")
+            # פיצוי - בלי טקסטים יתומים למסמכי היסטוריה שלא נכתבו
+            try:
+                await self.texts_collection.delete_many({"_id": {"$in": list(lost_ids)}})
+            except Exception as e:
+                logger.error(f"Failed to remove orphan prompt texts: {e}")
+        saved = [doc for doc in entries if doc["_id"] not in lost_ids]
+        if not saved:
+            return
+        logger.debug(f"Saved {len(saved)} prompt history documents")
+        await self._add_to_summary(saved)
+    
+    async def _add_to_summary(self, saved: List[Dict[str, Any]]):
+        """
+        ספירת מסמכים שנכתבו במסמך הסיכום - $inc אחד לאצווה.
+        הבנייה סופרת את מה שנוצר לפני ה-cutoff שלה והכותב רק את מה שמ-cutoff והלאה, כך שכל מסמך
+        נספר פעם אחת גם כשהבנייה רצה בזמן כתיבה. עד שהסיכום קיים המסמכים מוחזקים בזיכרון.
+        """
+        if self._summary_cutoff is None:
+            summary = await self.stats_collection.find_one({"_id": _STATS_SUMMARY_ID}, {"cutoff": 1})
+            if summary is None:
+                self._unsummarized.extend(saved)
+                return
+            # סיכום בלי cutoff נבנה לפני כל כתיבה של הכותב - הכותב סופר הכל
+            self._summary_cutoff = summary.get("cutoff", datetime.min)
+            saved, self._unsummarized = self._unsummarized + saved, []
         
-        result = await self.prompts_collection.insert_one(doc)
-        logger.debug(f"Saved prompt history: {result.inserted_id}")
-        return str(result.inserted_id)
+        counted = [doc for doc in saved if doc["created_at"] >= self._summary_cutoff]
+        if counted:
+            # בלי upsert - את המסמך יוצר רק ensure_stats_summary
+            await self.stats_collection.update_one(
+                {"_id": _STATS_SUMMARY_ID},
+                {"$inc": _summary_increments(counted)}
+            )
+    
+    async def _insert_with_retry(self, collection, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        bulk_write של InsertOne (ordered=False) עם ניסיונות חוזרים ו-backoff.
+        בכל ניסיון חוזר נשלחים רק המסמכים שנכשלו; מחזיר את מה שלא נכתב גם בסוף.
+        """
+        pending = docs
+        for attempt in range(_HISTORY_WRITE_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(_HISTORY_RETRY_DELAY * 2 ** (attempt - 1))
+            try:
+                await collection.bulk_write([InsertOne(doc) for doc in pending], ordered=False)
+                return []
+            except BulkWriteError as e:
+                # ordered=False - השאר נכתבו; duplicate key אומר שהמסמך כבר נכתב בניסיון קודם
+                failed = {
+                    error["index"] for error in e.details.get("writeErrors", [])
+                    if error.get("code") != _DUPLICATE_KEY_ERROR
+                }
+                pending = [doc for i, doc in enumerate(pending) if i in failed]
+                if not pending:
+                    return []
+                logger.warning(
+                    f"{collection.name}: {len(pending)} documents failed (attempt {attempt + 1}): {e}"
+                )
+            except Exception as e:
+                logger.warning(f"{collection.name}: write failed (attempt {attempt + 1}): {e}")
+        return pending
+    
+    async def flush_history(self):
+        """מחכה שכל ההיסטוריה שבתור תיכתב ועוצר את משימת הכתיבה (בכיבוי)"""
+        if self._history_writer is None or self._history_writer.done():
+            return
+        await self._history_queue.join()
+        self._history_writer.cancel()
     
     async def get_user_history(
         self, 
@@ -60,16 +383,14 @@ class MongoDB:
         limit: int = 10
     ) -> List[Dict[str, Any]]:
         """מחזיר היסטוריית פרומפטים של משתמש"""
-        cursor = self.prompts_collection.find(
-            {"user_id": user_id}
-        ).sort("created_at", DESCENDING).limit(limit)
-        
-        results = []
-        async for doc in cursor:
-            doc["_id"] = str(doc["_id"])
-            results.append(doc)
-        
-        return results
+        # סינון ומיון על המסמכים הקטנים (אינדקס user_id+created_at), הטקסטים רק ל-limit שנבחרו.
+        # ה-$project כבר מחזיר _id ו-category בפורמט הסופי - רק שדות התצוגה, בלי weaknesses
+        cursor = await self.prompts_collection.aggregate(
+            [{"$match": {"user_id": user_id}}, _HISTORY_SORT, {"$limit": limit}, _TEXTS_LOOKUP, _HISTORY_PROJECT],
+            batchSize=limit
+        )
+        # to_list + batchSize - כל המסמכים בתשובה אחת מהשרת ובמעבר אחד, בלי async for
+        return await cursor.to_list(length=limit)
     
     async def get_top_improvements(
         self,
@@ -80,36 +401,48 @@ class MongoDB:
         """
         מחזיר פרומפטים עם השיפור הגדול ביותר.
         שימושי לדוגמאות קהילתיות.
+        
+        התוצאה נשמרת ל-_TOP_IMPROVEMENTS_TTL שניות, וקוראים במקביל עם אותם פרמטרים
+        מחכים לאותה שאילתה (single-flight). הרשימה משותפת - לא לשנות אותה.
         """
+        key = (PromptCategory(category) if category else None, min_improvement, limit)
+        cached = self._top_cache.get(key)
+        if cached and time.monotonic() - cached[0] < _TOP_IMPROVEMENTS_TTL:
+            return cached[1]
+        
+        task = self._top_inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch_top_improvements(*key))
+            self._top_inflight[key] = task
+            task.add_done_callback(lambda _: self._top_inflight.pop(key, None))
+        # shield - ביטול של ממתין אחד לא מבטל את השאילתה לשאר
+        examples = await asyncio.shield(task)
+        
+        self._top_cache.pop(key, None)
+        self._top_cache[key] = (time.monotonic(), examples)
+        if len(self._top_cache) > _TOP_IMPROVEMENTS_CACHE_SIZE:
+            self._top_cache.pop(next(iter(self._top_cache)))  # הישן ביותר
+        return examples
+    
+    async def _fetch_top_improvements(
+        self,
+        category: Optional[PromptCategory],
+        min_improvement: int,
+        limit: int
+    ) -> List[Dict[str, Any]]:
+        """השאילתה עצמה מול המסד"""
         query = {}
         if category:
-            query["category"] = category.value
-        
-        # חיפוש פרומפטים עם שיפור משמעותי בציון
-        pipeline = [
-            {"$match": query},
-            {"$addFields": {
-                "improvement": {"$subtract": ["$score_after", "$score_before"]}
-            }},
-            {"$match": {"improvement": {"$gte": min_improvement}}},
-            {"$sort": {"improvement": -1, "score_after": -1}},
-            {"$limit": limit},
-            {"$project": {
-                "original_prompt": 1,
-                "improved_prompt": 1,
-                "category": 1,
-                "score_before": 1,
-                "score_after": 1,
-                "improvement": 1
-            }}
-        ]
+            query["category"] = _CATEGORY_CODES[category]
         
-        results = []
-        async for doc in self.prompts_collection.aggregate(pipeline):
-            doc["_id"] = str(doc["_id"])
-            results.append(doc)
+        # improvement נשמר במסמך - סינון ומיון על האינדקס החלקי, והטקסטים רק ל-limit שנבחרו
+        query["improvement"] = {"$gte": min_improvement}
+        cursor = await self.examples_collection.aggregate(
+            [{"$match": query}, _EXAMPLES_SORT, {"$limit": limit}, _TEXTS_LOOKUP, _EXAMPLES_PROJECT],
+            batchSize=limit
+        )
         
-        return results
+        return await cursor.to_list(length=limit)
     
     async def add_feedback(
         self,
@@ -119,102 +452,216 @@ class MongoDB:
         feedback_text: Optional[str] = None
     ):
         """הוספת משוב על שיפור"""
-        from bson import ObjectId
+        # ObjectId מחוץ ל-gather - id לא תקין נכשל לפני שנשלחת כתיבה כלשהי
+        object_id = ObjectId(prompt_id)
+        now = datetime.utcnow()
         
-        await self.prompts_collection.update_one(
-            {"_id": ObjectId(prompt_id)},
-            {"$set": {
+        # שני אוספים שונים - שתי הכתיבות נשלחות במקביל
+        await asyncio.gather(
+            self.prompts_collection.update_one(
+                {"_id": object_id},
+                {"$set": {
+                    "rating": rating,
+                    "feedback": feedback_text,
+                    "feedback_at": now
+                }}
+            ),
+            # שמירת משוב נפרד לניתוח
+            self.feedback_collection.insert_one({
+                "prompt_id": prompt_id,
+                "user_id": user_id,
                 "rating": rating,
-                "feedback": feedback_text,
-                "feedback_at": datetime.utcnow()
-            }}
+                "feedback_text": feedback_text,
+                "created_at": now
+            })
         )
-        
-        # שמירת משוב נפרד לניתוח
-        await self.feedback_collection.insert_one({
-            "prompt_id": prompt_id,
-            "user_id": user_id,
-            "rating": rating,
-            "feedback_text": feedback_text,
-            "created_at": datetime.utcnow()
-        })
     
     # ========== User Sessions ==========
     
     async def get_session(self, user_id: str) -> Optional[UserSession]:
-        """מחזיר סשן משתמש"""
-        doc = await self.sessions_collection.find_one({"user_id": user_id})
-        if doc:
-            doc.pop("_id", None)
-            return UserSession(**doc)
-        return None
+        """מחזיר סשן משתמש - קודם מ-Redis (אם מוגדר), אחרת מ-MongoDB"""
+        if self._redis:
+            cached = await self._redis.get(_session_key(user_id))
+            if cached:
+                return UserSession.model_validate_json(cached)
+        
+        # projection בלי _id - אין צורך להסיר אותו אחר כך
+        doc = await self.sessions_collection.find_one({"user_id": user_id}, {"_id": 0})
+        if not doc:
+            return None
+        session = UserSession.model_validate(doc)
+        if self._redis:
+            await self._redis.setex(_session_key(user_id), _SESSION_TTL, session.model_dump_json())
+        return session
     
     async def save_session(self, session: UserSession):
-        """שמירת/עדכון סשן"""
-        doc = session.model_dump()
-        await self.sessions_collection.update_one(
+        """שמירת/עדכון סשן (write-through: Redis ו-MongoDB יחד)"""
+        # הסשן נשמר תמיד במלואו - החלפת המסמך, בלי מיזוג $set בצד השרת
+        writes = [self.sessions_collection.replace_one(
             {"user_id": session.user_id},
-            {"$set": doc},
+            session.model_dump(),
             upsert=True
-        )
+        )]
+        if self._redis:
+            writes.append(self._redis.setex(
+                _session_key(session.user_id), _SESSION_TTL, session.model_dump_json()
+            ))
+        await asyncio.gather(*writes)
+    
+    async def pop_session(
+        self,
+        user_id: str,
+        awaiting_response: Optional[str] = None
+    ) -> Optional[UserSession]:
+        """
+        קריאה ומחיקה של סשן בפעולה אטומית אחת.
+        אם awaiting_response סופק - נמחק רק סשן שמחכה לתגובה הזו.
+        """
+        query = {"user_id": user_id}
+        if awaiting_response is not None:
+            query["awaiting_response"] = awaiting_response
+        # MongoDB נשאר מקור האמת - המחיקה האטומית שם, ו-Redis מתנקה רק אם באמת נמחק סשן
+        doc = await self.sessions_collection.find_one_and_delete(query, projection={"_id": 0})
+        if not doc:
+            return None
+        if self._redis:
+            await self._redis.delete(_session_key(user_id))
+        return UserSession.model_validate(doc)
     
     async def clear_session(self, user_id: str):
         """מחיקת סשן"""
-        await self.sessions_collection.delete_one({"user_id": user_id})
+        deletes = [self.sessions_collection.delete_one({"user_id": user_id})]
+        if self._redis:
+            deletes.append(self._redis.delete(_session_key(user_id)))
+        await asyncio.gather(*deletes)
     
     # ========== Statistics ==========
     
     async def get_stats(self) -> Dict[str, Any]:
-        """סטטיסטיקות כלליות"""
-        total_prompts = await self.prompts_collection.count_documents({})
-        
-        # ממוצע שיפור
-        pipeline = [
-            {"$addFields": {
-                "improvement": {"$subtract": ["$score_after", "$score_before"]}
-            }},
-            {"$group": {
-                "_id": None,
-                "avg_improvement": {"$avg": "$improvement"},
-                "avg_score_before": {"$avg": "$score_before"},
-                "avg_score_after": {"$avg": "$score_after"}
-            }}
-        ]
-        
-        stats_result = await self.prompts_collection.aggregate(pipeline).to_list(1)
-        
-        # חלוקה לפי קטגוריות
-        category_pipeline = [
-            {"$group": {
-                "_id": "$category",
-                "count": {"$sum": 1}
-            }}
-        ]
-        categories = await self.prompts_collection.aggregate(category_pipeline).to_list(None)
+        """
+        סטטיסטיקות כלליות, שמורות בזיכרון ל-_STATS_TTL שניות.
+        קוראים במקביל מחכים לחישוב אחד במקום להריץ כל אחד aggregation משלו.
+        """
+        if self._stats_cache and time.monotonic() - self._stats_cache[0] < _STATS_TTL:
+            return self._stats_cache[1]
+        async with self._stats_lock:
+            # אולי מישהו אחר חישב בזמן שחיכינו למנעול
+            if self._stats_cache and time.monotonic() - self._stats_cache[0] < _STATS_TTL:
+                return self._stats_cache[1]
+            stats = await self._compute_stats()
+            self._stats_cache = (time.monotonic(), stats)
+            return stats
+    
+    async def _compute_stats(self) -> Dict[str, Any]:
+        """קריאת מסמך הסיכום - find_one במקום aggregation על כל האוסף"""
+        summary = await self.stats_collection.find_one({"_id": _STATS_SUMMARY_ID})
+        if summary is None:
+            # הבנייה בעליה נכשלה או לא רצה - בונים עכשיו (ושוב בקריאה הבאה אם גם זה נכשל).
+            # בטוח גם בזמן כתיבה: הבנייה והכותב מתחלקים בספירה לפי ה-cutoff
+            await self.ensure_stats_summary()
+            summary = await self.stats_collection.find_one({"_id": _STATS_SUMMARY_ID}) or {}
+        count = summary.get("count", 0)
+        averages = {}
+        if count:
+            averages = {
+                "avg_improvement": (summary["sum_after"] - summary["sum_before"]) / count,
+                "avg_score_before": summary["sum_before"] / count,
+                "avg_score_after": summary["sum_after"] / count
+            }
         
         return {
-            "total_prompts": total_prompts,
-            "averages": stats_result[0] if stats_result else {},
-            "by_category": {c["_id"]: c["count"] for c in categories}
+            "total_prompts": count,
+            "averages": averages,
+            "by_category": summary.get("by_category", {})
         }
     
+    async def ensure_stats_summary(self):
+        """בניית מסמך הסיכום מההיסטוריה שלפני ה-cutoff (פעם אחת, אם הוא עוד לא קיים)"""
+        if await self.stats_collection.find_one({"_id": _STATS_SUMMARY_ID}, {"_id": 1}):
+            return
+        
+        # עיגול למילישניות כמו ש-MongoDB שומר תאריכים - אותו גבול בדיוק ב-$match ואצל הכותב
+        cutoff = datetime.utcnow() - _STATS_SUMMARY_CUTOFF_MARGIN
+        cutoff = cutoff.replace(microsecond=cutoff.microsecond // 1000 * 1000)
+        
+        # ב-PyMongo Async, aggregate עצמו הוא coroutine שמחזיר cursor
+        cursor = await self.prompts_collection.aggregate(
+            [{"$match": {"created_at": {"$lt": cutoff}}}, _STATS_SUMMARY_FACET]
+        )
+        facets = (await cursor.to_list(1))[0]
+        
+        totals = facets["totals"]
+        summary = totals[0] if totals else {"count": 0, "sum_before": 0, "sum_after": 0}
+        summary.pop("_id", None)
+        summary["by_category"] = {_category_name(c["_id"]): c["count"] for c in facets["by_category"]}
+        summary["cutoff"] = cutoff
+        # $setOnInsert - אם בנייה אחרת (worker אחר) הקדימה, שלה נשארת יחד עם ה-cutoff שלה
+        await self.stats_collection.update_one(
+            {"_id": _STATS_SUMMARY_ID},
+            {"$setOnInsert": summary},
+            upsert=True
+        )
+    
     # ========== Indexes ==========
     
     async def ensure_indexes(self):
         """יצירת אינדקסים נדרשים"""
-        # אינדקס על user_id
-        await self.prompts_collection.create_index("user_id")
-        
-        # אינדקס על קטגוריה
-        await self.prompts_collection.create_index("category")
+        # מיגרציות מסמכים ישנים - לפני בניית הסיכום
+        await self._run_history_migrations()
         
-        # אינדקס על תאריך
-        await self.prompts_collection.create_index([("created_at", DESCENDING)])
-        
-        # אינדקס משולב לחיפוש דוגמאות טובות
-        await self.prompts_collection.create_index([
-            ("category", 1),
-            ("score_after", DESCENDING)
-        ])
+        # כל האינדקסים בפקודת create_indexes אחת לכל אוסף, והאוספים (השונים) במקביל
+        await asyncio.gather(
+            self.prompts_collection.create_indexes([
+                # היסטוריית משתמש - סינון לפי user_id ומיון לפי תאריך בלי שלב SORT
+                IndexModel([("user_id", 1), ("created_at", DESCENDING)]),
+                IndexModel("category"),
+                IndexModel([("created_at", DESCENDING)]),
+                # חיפוש דוגמאות טובות
+                IndexModel([("category", 1), ("score_after", DESCENDING)]),
+                # דוגמאות קהילתיות - רק פרומפטים שהשתפרו בפועל
+                IndexModel(
+                    [("category", 1), ("improvement", DESCENDING), ("score_after", DESCENDING)],
+                    partialFilterExpression={"improvement": {"$gte": 1}}
+                )
+            ]),
+            # כל פעולות הסשן מחפשות לפי user_id
+            self.sessions_collection.create_indexes([IndexModel("user_id")])
+        )
+        # רק אחרי ש-create_indexes חזר - בלי DDL מקביל על אותו אוסף
+        await self._drop_legacy_indexes()
         
         logger.info("MongoDB indexes created")
+        self._start_history_writer()
+    
+    async def _run_history_migrations(self):
+        """מריץ את המיגרציות שעוד לא סומנו כהושלמו - בעליה רגילה זו רק קריאה אחת ל-migrations"""
+        done = await self.migrations_collection.find(
+            {"_id": {"$in": list(_HISTORY_MIGRATIONS)}}, {"_id": 1}
+        ).to_list(None)
+        done = {doc["_id"] for doc in done}
+        pending = [name for name in _HISTORY_MIGRATIONS if name not in done]
+        if not pending:
+            return
+        
+        await self.prompts_collection.bulk_write(
+            [op for name in pending for op in _HISTORY_MIGRATIONS[name]],
+            ordered=False
+        )
+        # הסימון רק אחרי שהכתיבה הצליחה; המיגרציות אידמפוטנטיות, כך ששני workers במקביל זה בסדר
+        now = datetime.utcnow()
+        await self.migrations_collection.bulk_write([
+            UpdateOne({"_id": name}, {"$setOnInsert": {"done_at": now}}, upsert=True)
+            for name in pending
+        ], ordered=False)
+        logger.info(f"History migrations done: {pending}")
+    
+    async def _drop_legacy_indexes(self):
+        """האינדקס הישן על user_id לבד הוא prefix של המשולב - מיותר"""
+        try:
+            await self.prompts_collection.drop_index("user_id_1")
+        except OperationFailure:
+            pass  # כבר לא קיים
+
+
+# Singleton instance - חיבור ו-connection pool אחד לכל התהליך
+db = MongoDB()